@@ -1,162 +1,625 @@
 # clamav_agent.py
 # This script acts as a standalone server that receives files over a socket,
-# scans them using the ClamAV command-line tool, and returns a
+# scans them using a running ClamAV daemon (clamd), and returns a
 # simple result (OK, INFECTED, or ERROR).
 
 import socket
-import tempfile
+import struct
 import os
+import select
+import signal
 
 import sys
-import subprocess
+import time
+import queue
+import logging
+import logging.handlers
+from concurrent.futures import ThreadPoolExecutor
+try:
+    import fcntl
+except ImportError:  # Not available on Windows.
+    fcntl = None
 
 # --- Configuration ---
 # Global settings for the server.
 HOST = '0.0.0.0'  # Listen on all available network interfaces.
 PORT = 12067      # The port this server will listen on.
-BUFFER_SIZE = 4096 # Size of chunks for receiving file data.
+BUFFER_SIZE = 1 << 20 # Size of chunks for receiving file data (1 MiB).
+SOCKET_RCVBUF = 4 << 20 # Kernel receive buffer for client connections (4 MiB).
+SMALL_FILE_LIMIT = 1 << 20 # Files smaller than this are received whole, then scanned (must fit in BUFFER_SIZE).
+SCAN_TIMEOUT = 300 # Seconds to wait for clamd to return a verdict.
+CLIENT_TIMEOUT = 600 # Seconds a client connection may stall before it is dropped.
+# Seconds a client may keep an idle connection open between scans. Every open connection
+# holds one of its worker's THREADS_PER_WORKER threads, so this is kept short; clients
+# simply reconnect for their next scan.
+CLIENT_IDLE_TIMEOUT = 15
+LOG_LEVEL = logging.WARNING # Use logging.INFO to log every request (development).
+# Agent protocol header: 4-byte name length, the name, then an 8-byte file size (big-endian).
+NAME_LEN_HEADER = struct.Struct('!I')
+FILE_SIZE_HEADER = struct.Struct('!Q')
+REPLY_LEN_HEADER = struct.Struct('!I')
+MAX_NAME_LEN = 4096 # Longest file name accepted in the header.
+MAX_FILE_SIZE = 100 * 1024 * 1024 # Largest file accepted for scanning (100 MiB).
+# On Linux, file data is moved from the client socket to clamd with splice(2)
+# through a pipe, so it never has to be copied into Python.
+USE_SPLICE = hasattr(os, 'splice')
+# Where supported, one worker process per core accepts connections on the same
+# port (SO_REUSEPORT) and serves them from its own thread pool.
+if hasattr(os, 'fork') and hasattr(socket, 'SO_REUSEPORT'):
+    WORKER_PROCESSES = os.cpu_count() or 1
+else:
+    WORKER_PROCESSES = 1
+THREADS_PER_WORKER = 16
+LISTEN_BACKLOG = 128
+# Idle clamd sessions kept open per process, so that all processes together keep no more
+# idle sessions than clamd's default MaxThreads (10). This doesn't limit concurrent scans:
+# a busy process opens extra sessions as needed and clamd queues what it can't serve yet
+# (MaxQueue); those sessions are closed again instead of kept once they are done.
+CLAMD_POOL_SIZE = max(1, 10 // WORKER_PROCESSES)
+CLAMD_SESSION_IDLE = 20 # Seconds a session may sit idle before it is replaced (clamd's IdleTimeout is 30).
 
 
 
-def get_clamscan_path():
+# Per-request messages go through this logger (see start_logging).
+log = logging.getLogger('clamav_agent')
+
+def start_logging():
+    """
+    Routes log records through a queue to a background thread, so request
+    threads only enqueue a record instead of waiting on console output.
+    Called once in every worker process.
+    """
+    log_queue = queue.SimpleQueue()
+    log.setLevel(LOG_LEVEL)
+    log.propagate = False
+    log.addHandler(logging.handlers.QueueHandler(log_queue))
+    listener = logging.handlers.QueueListener(log_queue, logging.StreamHandler(sys.stdout))
+    listener.start()
+
+def get_clamd_address():
     """
-    Determines the correct path to the ClamAV scanner executable based on the
+    Determines where the ClamAV daemon (clamd) is listening based on the
     operating system (Windows or Linux).
     """
     if sys.platform.startswith('win'):
-        # return r"C:\\Program Files (x86)\\clam\\clam\\clamscan.exe"
-        # Standard installation path for ClamAV on Windows.
-        return r"C:\\Program Files\\ClamAV\\clamscan.exe"
+        # clamd on Windows only offers a TCP socket (TCPSocket in clamd.conf).
+        return ('127.0.0.1', 3310)
     elif sys.platform.startswith('linux'):
-        # Path for the ClamAV daemon scanner on Linux, which is often faster.
-        return '/usr/bin/clamdscan'
+        # Default LocalSocket of the Debian/Ubuntu clamav-daemon package.
+        return '/var/run/clamav/clamd.ctl'
     else:
         # Exit if the OS is not supported.
         print(f"[SERVER ERROR] Unsupported OS: {sys.platform}")
         sys.exit(1)
 
-def scan_with_clamscan(file_path):
+# --- clamd protocol messages ---
+# Commands use the 'z' prefix, so they and their replies are null-terminated.
+CLAMD_PING = b'zPING\0'
+CLAMD_IDSESSION = b'zIDSESSION\0'
+CLAMD_INSTREAM = b'zINSTREAM\0'
+# Every INSTREAM chunk starts with its length; a zero-length chunk ends the upload.
+CLAMD_CHUNK_LEN = struct.Struct('!I')
+CLAMD_END_OF_STREAM = CLAMD_CHUNK_LEN.pack(0)
+
+class ClamdError(Exception):
+    """For errors while talking to the clamd daemon."""
+    pass
+
+class ClamdClient:
     """
-    Scans a given file using the ClamAV executable in a separate process.
+    A minimal client for the clamd socket protocol.
 
-    Returns a simple string indicating the scan result ('OK', 'INFECTED', 'SCAN_ERROR').
+    clamd keeps the signature database loaded in memory, so a scan is a single
+    request/response over a Unix or TCP socket instead of a new clamscan
+    process that reloads the database for every file.
     """
-    clamscan_path = get_clamscan_path()
-    # Ensure the clamscan executable exists and is runnable.
-    if not os.path.exists(clamscan_path):
-        print(f"[SERVER ERROR] Clamscan not found at '{clamscan_path}'.")
-        sys.exit(1)
-    if not os.access(clamscan_path, os.X_OK):
-        print(f"[SERVER ERROR] Clamscan at '{clamscan_path}' is not executable.")
-        sys.exit(1)
-    try:
-        # Execute the scanner with arguments for clean, machine-readable output.
-        result = subprocess.run([
-            clamscan_path,
-            "--stdout",
-            "--no-summary",
-            "--quiet",
-            "--infected",
-            "--max-filesize=100M",
-            "--max-scansize=100M",
-            file_path
-        ], capture_output=True, text=True, timeout=300)
-
-        # Interpret the exit code from the scanner.
-        # 1 = File is infected.
-        # 0 = File is clean.
-        # Other = An error occurred during the scan.
-        if result.returncode == 1:
-            return "INFECTED"
-        elif result.returncode == 0:
-            return "OK"
+    def __init__(self, address, timeout=SCAN_TIMEOUT):
+        self.address = address
+        self.timeout = timeout
+        # A path means clamd's LocalSocket, a (host, port) tuple its TCPSocket.
+        self.family = socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+
+    def _connect(self):
+        """Open a new socket to the daemon."""
+        sock = socket.socket(self.family, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.address)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def _command(self, command):
+        """Send a pre-encoded command (one of the CLAMD_* constants) and return the reply."""
+        with self._connect() as sock:
+            sock.sendall(command)
+            return _recv_reply(sock)
+
+    def ping(self):
+        """Check that the daemon is alive."""
+        reply = self._command(CLAMD_PING)
+        if reply != 'PONG':
+            raise ClamdError(f"Unexpected PING reply: {reply}")
+
+    def open_session(self):
+        """
+        Open a connection in IDSESSION mode, which clamd keeps open for
+        several commands instead of closing it after the first reply.
+        """
+        sock = self._connect()
+        try:
+            sock.sendall(CLAMD_IDSESSION)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+class ClamdPool:
+    """
+    A pool of open clamd sessions shared by the worker threads of one process,
+    so a scan does not pay for a new connection to the daemon every time. Only
+    the idle sessions are limited (to size); scans never wait for a session.
+    """
+    def __init__(self, client, size):
+        self.client = client
+        # Most recently used first: those are the least likely to have been idled out by clamd.
+        self.idle = queue.LifoQueue(maxsize=size)
+
+    def _acquire(self):
+        """Take an idle session that is still usable, or None if there is none."""
+        while True:
+            try:
+                sock, last_used = self.idle.get_nowait()
+            except queue.Empty:
+                return None
+            # clamd closes sessions after its IdleTimeout; an idle session that is
+            # readable has been closed (or has unexpected data) and can't be used.
+            if (time.monotonic() - last_used < CLAMD_SESSION_IDLE
+                    and not select.select([sock], [], [], 0)[0]):
+                return sock
+            sock.close()
+
+    def release(self, sock):
+        """Return a session after a completed scan."""
+        try:
+            self.idle.put_nowait((sock, time.monotonic()))
+        except queue.Full:
+            sock.close()
+
+    def instream(self):
+        """Start an INSTREAM scan and return a ClamdStream to feed the file data into."""
+        sock = self._acquire()
+        if sock is not None:
+            try:
+                sock.sendall(CLAMD_INSTREAM)
+                return ClamdStream(sock, self)
+            except OSError:
+                sock.close()
+        sock = self.client.open_session()
+        try:
+            sock.sendall(CLAMD_INSTREAM)
+        except OSError:
+            sock.close()
+            raise
+        return ClamdStream(sock, self)
+
+class ClamdStream:
+    """
+    An INSTREAM scan in progress. Data is sent to clamd as length-prefixed
+    chunks while it is still being received, so the file never touches the disk.
+    """
+    def __init__(self, sock, pool):
+        self.sock = sock
+        self.pool = pool
+        # Set once clamd has answered, so the session can be used for another scan.
+        self.finished = False
+        # Set when clamd stops accepting data, e.g. once StreamMaxLength is exceeded.
+        self.broken = False
+        # Pipe used to splice data from the client socket into clamd (Linux only).
+        self.pipe = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if self.finished:
+            self.pool.release(self.sock)
         else:
-            print(f"[SERVER ERROR] ClamAV error (code {result.returncode})")
-            return "SCAN_ERROR:ClamAVError"
-    except Exception as e:
-        # Catch any other exceptions, like a timeout.
-        print(f"[SERVER ERROR] Exception during clamscan: {e}")
+            self.sock.close()
+        if self.pipe:
+            for fd in self.pipe:
+                os.close(fd)
+
+    def write(self, chunk):
+        """Forward one chunk of file data to clamd."""
+        if self.broken:
+            return
+        try:
+            self.sock.sendall(CLAMD_CHUNK_LEN.pack(len(chunk)) + chunk)
+        except OSError:
+            # clamd closes the stream early when it rejects it; its reply explains why.
+            self.broken = True
+
+    def receive_from(self, conn, count, view):
+        """
+        Receives up to count bytes of file data from the client and forwards them to clamd.
+
+        Uses splice(2) where available; otherwise the data goes through view, a
+        preallocated buffer of at least count bytes. Returns the number of bytes
+        taken from the client, or 0 if it disconnected.
+        """
+        if not USE_SPLICE or self.broken:
+            received = conn.recv_into(view[:count])
+            if received:
+                self.write(view[:received])
+            return received
+        if self.pipe is None:
+            self.pipe = os.pipe()
+            try:
+                # Let a whole chunk fit in the pipe instead of the default 64 KiB.
+                fcntl.fcntl(self.pipe[1], fcntl.F_SETPIPE_SZ, count)
+            except (AttributeError, OSError):
+                pass
+        pipe_r, pipe_w = self.pipe
+        # The INSTREAM chunk length has to be sent up front, so a client that
+        # disconnects mid-chunk leaves a truncated stream; it is discarded anyway.
+        try:
+            self.sock.sendall(CLAMD_CHUNK_LEN.pack(count))
+        except OSError:
+            self.broken = True
+            return self.receive_from(conn, count, view)
+        received = 0
+        while received < count:
+            moved = _splice(conn, pipe_w, count - received, conn, False)
+            if not moved:
+                break
+            received += moved
+            try:
+                while moved:
+                    moved -= _splice(pipe_r, self.sock, moved, self.sock, True)
+            except OSError:
+                self.broken = True
+                return received
+        return received
+
+    def result(self):
+        """
+        Finish the stream and wait for the verdict.
+
+        Returns None if the data is clean, or the virus name if it is infected.
+        """
+        if not self.broken:
+            self.sock.sendall(CLAMD_END_OF_STREAM)
+        reply = _recv_reply(self.sock)
+        if not reply:
+            raise ClamdError("clamd closed the stream without a reply")
+        # Session replies look like '<id>: stream: OK', '<id>: stream: <virus> FOUND'
+        # or '<id>: stream: <reason> ERROR'.
+        status = reply.rpartition(': ')[2]
+        if status == 'OK':
+            self.finished = True
+            return None
+        if status.endswith(' FOUND'):
+            self.finished = True
+            return status[:-len(' FOUND')]
+        raise ClamdError(status)
+
+def _splice(src, dst, count, wait_sock, wait_for_write):
+    """
+    Moves up to count bytes between two file descriptors (or sockets) with
+    os.splice. Sockets with a timeout are non-blocking at the OS level, so wait
+    on wait_sock with select() whenever the kernel is not ready yet.
+    """
+    src_fd = src if isinstance(src, int) else src.fileno()
+    dst_fd = dst if isinstance(dst, int) else dst.fileno()
+    while True:
+        try:
+            return os.splice(src_fd, dst_fd, count, flags=os.SPLICE_F_MOVE)
+        except BlockingIOError:
+            waiting = ([], [wait_sock], []) if wait_for_write else ([wait_sock], [], [])
+            if not any(select.select(*waiting, wait_sock.gettimeout())):
+                raise socket.timeout("timed out")
+
+def _recv_reply(sock):
+    """
+    Read a null-terminated reply from clamd.
+
+    The socket timeout bounds the whole wait, not each recv(), so a scan
+    cannot hold a worker thread for longer than SCAN_TIMEOUT.
+    """
+    timeout = sock.gettimeout()
+    deadline = time.monotonic() + timeout
+    reply = b''
+    try:
+        while not reply.endswith(b'\0'):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise socket.timeout("timed out waiting for clamd")
+            sock.settimeout(remaining)
+            # Replies are a single short line, so don't allocate a full BUFFER_SIZE for them.
+            chunk = sock.recv(1024)
+            if not chunk:
+                break
+            reply += chunk
+    finally:
+        # Pooled sessions are reused, so give the next command the full timeout again.
+        sock.settimeout(timeout)
+    return reply.rstrip(b'\0').decode('utf-8', errors='replace')
+
+# A single client for the daemon, created once at startup, and the pool of
+# sessions the worker threads scan through.
+clamd = ClamdClient(get_clamd_address())
+clamd_pool = ClamdPool(clamd, CLAMD_POOL_SIZE)
+
+def open_clamd_stream():
+    """
+    Starts an INSTREAM scan on the clamd daemon.
+
+    Returns a ClamdStream, or None if clamd cannot be reached.
+    """
+    for attempt in range(2):
+        try:
+            return clamd_pool.instream()
+        except OSError as e:
+            # The daemon may have been restarted (e.g. after a signature update);
+            # make sure it is reachable again before retrying once.
+            log.warning("[SERVER ERROR] Lost connection to clamd: %s", e)
+            if attempt == 0:
+                try:
+                    clamd.ping()
+                    continue
+                except (OSError, ClamdError):
+                    pass
+            return None
+
+def scan_stream_result(stream):
+    """
+    Finishes a streamed scan.
+
+    Returns a simple string indicating the scan result ('OK', 'INFECTED:<virus>', 'SCAN_ERROR').
+    """
+    try:
+        virus = stream.result()
+    except ClamdError as e:
+        log.error("[SERVER ERROR] ClamAV error: %s", e)
+        return "SCAN_ERROR:ClamAVError"
+    except OSError as e:
+        log.error("[SERVER ERROR] Exception during clamd scan: %s", e)
         return f"SCAN_ERROR:ClamAVException_{e}"
+    if virus is None:
+        return "OK"
+    return f"INFECTED:{virus}"
+
+def recv_exact(sock, n):
+    """
+    Receives exactly n bytes from a socket.
+
+    Returns None if the peer disconnects first.
+    """
+    buf = bytearray(n)
+    if recv_into_exact(sock, memoryview(buf)) < n:
+        return None
+    return buf
+
+def recv_into_exact(sock, view):
+    """
+    Fills view with data from a socket. A single recv() may return fewer
+    bytes than asked for, so keep reading until the buffer is full.
+
+    Returns the number of bytes received, which is less than len(view) only
+    if the peer disconnected.
+    """
+    received = 0
+    while received < len(view):
+        count = sock.recv_into(view[received:])
+        if not count:
+            break
+        received += count
+    return received
+
+def send_reply(conn, reply):
+    """Sends a reply string, prefixed with its length so the client knows where it ends."""
+    data = reply.encode('utf-8')
+    conn.sendall(REPLY_LEN_HEADER.pack(len(data)) + data)
 
 def handle_client(conn, addr):
     """
     Manages the entire communication with a single connected client.
-    It follows a simple protocol to receive the file, scan it, and send a result.
+    A client may send any number of files over one connection; each one is
+    received, scanned and answered in turn.
     """
-    print(f"[SERVER] Connection established with client: {addr}")
-    tmp_path = None
+    log.info("[SERVER] Connection established with client: %s", addr)
+    # One receive buffer for the whole connection instead of a new bytes object per chunk.
+    view = memoryview(bytearray(BUFFER_SIZE))
     try:
-        # --- Protocol Step 1: Receive file name ---
-        name_len_bytes = conn.recv(4)
-        if not name_len_bytes:
-            print("[SERVER] Client disconnected during file name length reception.")
-            conn.sendall(b"ERROR:ClientDisconnected")
-            return
-        name_len = int.from_bytes(name_len_bytes, 'big')
+        while handle_scan_request(conn, view):
+            pass
+    except socket.error as se:
+        log.error("[SERVER ERROR] Socket error: %s", se)
+    except Exception as e:
+        log.error("[SERVER ERROR] Unexpected error: %s", e)
 
-        file_name_bytes = conn.recv(name_len)
-        if not file_name_bytes:
-            print("[SERVER] Client disconnected during file name reception.")
-            conn.sendall(b"ERROR:ClientDisconnected")
-            return
-        file_name = file_name_bytes.decode('utf-8')
+def handle_scan_request(conn, view):
+    """
+    Receives one file, scans it and sends the result.
 
-        # --- Protocol Step 2: Receive file size ---
-        file_size_bytes = conn.recv(8)
-        if not file_size_bytes:
-            print("[SERVER] Client disconnected during file size reception.")
-            conn.sendall(b"ERROR:ClientDisconnected")
-            return
-        file_size = int.from_bytes(file_size_bytes, 'big')
+    Returns True if the connection is ready for the next request, False if it
+    should be closed (the client left, or its data can no longer be followed).
+    """
+    # --- Protocol Step 1: Receive file name length ---
+    # Between requests the connection is idle, so don't hold a thread for long.
+    conn.settimeout(CLIENT_IDLE_TIMEOUT)
+    try:
+        name_len_bytes = recv_exact(conn, NAME_LEN_HEADER.size)
+    except socket.timeout:
+        log.info("[SERVER] Closing idle client connection.")
+        return False
+    if name_len_bytes is None:
+        log.info("[SERVER] Client closed the connection.")
+        return False
+    conn.settimeout(CLIENT_TIMEOUT)
+    name_len, = NAME_LEN_HEADER.unpack(name_len_bytes)
+    if name_len > MAX_NAME_LEN:
+        log.info("[SERVER] Rejected file name of %s bytes.", name_len)
+        send_reply(conn, "ERROR:TooLarge")
+        return False
+
+    # --- Protocol Step 2: Receive file name and file size in one read ---
+    header = recv_exact(conn, name_len + FILE_SIZE_HEADER.size)
+    if header is None:
+        log.info("[SERVER] Client disconnected during file name/size reception.")
+        return False
+    # The name is only used in log lines and never reaches the filesystem, so
+    # decode at most its first 64 bytes and don't fail on invalid UTF-8.
+    file_name = header[:min(name_len, 64)].decode('utf-8', errors='replace')
+    file_size, = FILE_SIZE_HEADER.unpack_from(header, name_len)
+    if file_size > MAX_FILE_SIZE:
+        # Refuse before receiving anything instead of streaming data clamd won't scan.
+        log.info("[SERVER] Rejected file '%s' of %s bytes.", file_name, file_size)
+        send_reply(conn, "ERROR:TooLarge")
+        return False
 
-        # --- Protocol Step 3: Receive file content and save to a temporary file ---
-        with tempfile.NamedTemporaryFile(delete=False, dir=tempfile.gettempdir(),
-                                         prefix="clamscan_server_", suffix=f"_{file_name}") as tmp_f:
-            tmp_path = tmp_f.name
+    # --- Protocol Step 3: Stream file content straight into clamd ---
+    small_file = file_size < SMALL_FILE_LIMIT
+    if small_file:
+        # Small files fit in the receive buffer: take them whole and hand them
+        # to clamd as a single chunk, skipping the per-chunk splice setup.
+        if recv_into_exact(conn, view[:file_size]) < file_size:
+            log.info("[SERVER] Client disconnected during file transfer.")
+            return False
+
+    stream = open_clamd_stream()
+    if stream is None:
+        send_reply(conn, "SCAN_ERROR:ClamdUnavailable")
+        # A large file's data is still unread, so the connection can't be reused.
+        return small_file
+    with stream:
+        if small_file:
+            # A zero-length chunk would end the stream early, so skip empty files.
+            if file_size:
+                stream.write(view[:file_size])
+        else:
             bytes_read = 0
             while bytes_read < file_size:
-                chunk = conn.recv(min(BUFFER_SIZE, file_size - bytes_read))
-                if not chunk:
-                    print("[SERVER] Client disconnected during file transfer.")
-                    break
-                tmp_f.write(chunk)
-                bytes_read += len(chunk)
+                count = stream.receive_from(conn, min(BUFFER_SIZE, file_size - bytes_read), view)
+                if not count:
+                    log.info("[SERVER] Client disconnected during file transfer.")
+                    return False
+                bytes_read += count
 
-        print(f"[SERVER] File '{file_name}' ({file_size} bytes) saved to {tmp_path}")
+        log.info("[SERVER] File '%s' (%s bytes) streamed to clamd", file_name, file_size)
 
-        # Set file permissions to be safe (Linux/macOS only).
-        if not sys.platform.startswith('win'):
-            os.chmod(tmp_path, 0o644)
-            print(f"[SERVER] Set permissions for {tmp_path} to 0o644.")
+        # --- Step 4: Get the verdict ---
+        result_string = scan_stream_result(stream)
 
-        # --- Step 4: Scan the file ---
-        result_string = scan_with_clamscan(tmp_path)
+    # --- Step 5: Send the result back to the client ---
+    log.info("[SERVER] Sending scan result to client: '%s'", result_string)
+    send_reply(conn, result_string)
+    return True
 
-        # --- Step 5: Send the result back to the client ---
-        print(f"[SERVER] Sending scan result to client: '{result_string}'")
-        conn.sendall(result_string.encode('utf-8'))
+def tune_client_socket(conn):
+    """Sets the TCP options used for client connections."""
+    # Send the short scan result immediately instead of letting Nagle hold it back.
+    conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    # Detect clients that silently went away instead of waiting on them forever.
+    conn.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    if hasattr(socket, 'TCP_KEEPIDLE'):
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 30)
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 10)
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)
+    # Hard cap on how long any single read or write may stall.
+    conn.settimeout(CLIENT_TIMEOUT)
 
-    except socket.error as se:
-        print(f"[SERVER ERROR] Socket error: {se}")
-    except Exception as e:
-        print(f"[SERVER ERROR] Unexpected error: {e}")
-    finally:
-        # --- Cleanup ---
-        # Ensure the temporary file is deleted, even if errors occurred.
-        if tmp_path and os.path.exists(tmp_path):
-            os.remove(tmp_path)
-            print(f"[SERVER] Cleaned up temporary file: {tmp_path}")
+def serve_client(conn, addr):
+    """Runs handle_client for one connection and closes it afterwards."""
+    with conn:
+        tune_client_socket(conn)
+        handle_client(conn, addr)
 
-# --- Main server loop ---
-if __name__ == '__main__':
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server:
-        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        server.bind((HOST, PORT))
-        server.listen(1)
-        print(f"[SERVER] ClamAV scanning agent listening for clients on port {PORT}...")
+def create_server_socket():
+    """Creates the agent's listening socket."""
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if hasattr(socket, 'SO_REUSEPORT'):
+        # Lets every worker process bind its own socket to PORT; the kernel
+        # spreads incoming connections across them.
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    # Set before listen() so accepted connections inherit it and the TCP window
+    # scale is negotiated for it during the handshake.
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_RCVBUF)
+    server.bind((HOST, PORT))
+    server.listen(LISTEN_BACKLOG)
+    return server
 
-        # Continuously accept new client connections.
+def serve_forever(server):
+    """Accepts clients on server and serves them from a pool of threads."""
+    start_logging()
+    with server, ThreadPoolExecutor(max_workers=THREADS_PER_WORKER) as pool:
+        # Continuously accept new client connections. Uploads and scans from
+        # different clients overlap instead of waiting for each other.
         while True:
             conn, addr = server.accept()
-            with conn:
-                handle_client(conn, addr)
+            pool.submit(serve_client, conn, addr)
+
+def watch_workers(children):
+    """Installs the parent's handlers for its forked worker processes.
+
+    Workers that exit are reaped as soon as the kernel reports them, and
+    SIGTERM/SIGINT are passed on to the remaining workers and waited for, so
+    stopping the parent never leaves orphans holding PORT through SO_REUSEPORT.
+    """
+    def reap(signum, frame):
+        while children:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                children.clear()
+                return
+            if pid == 0:
+                return
+            if pid in children:
+                children.remove(pid)
+
+    def stop(signum, frame):
+        for pid in list(children):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+        for pid in list(children):
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass  # Already reaped by the SIGCHLD handler.
+        sys.exit(128 + signum)
+
+    signal.signal(signal.SIGCHLD, reap)
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+# --- Main server loop ---
+if __name__ == '__main__':
+    try:
+        clamd.ping()
+    except (OSError, ClamdError) as e:
+        print(f"[SERVER ERROR] clamd is not reachable at {clamd.address}: {e}")
+        sys.exit(1)
+    # Bind in the parent first so a port that is already in use is reported once.
+    server = create_server_socket()
+    print(f"[SERVER] ClamAV scanning agent listening for clients on port {PORT}...")
+
+    children = []
+    for _ in range(WORKER_PROCESSES - 1):
+        pid = os.fork()
+        if pid == 0:
+            server.close()
+            try:
+                serve_forever(create_server_socket())
+            finally:
+                os._exit(0)
+        children.append(pid)
+    if children:
+        # Installed after forking so the workers keep the default handlers.
+        watch_workers(children)
+    serve_forever(server)
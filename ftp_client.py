@@ -1,15 +1,30 @@
 # ftp_client.py
 # This is a command-line FTP client with enhanced features:
-# - Integrates with a ClamAV agent to scan files for viruses before uploading.
+# - Integrates with a ClamAV agent to scan files for viruses before they are published on the server.
 # - Displays progress bars for uploads, downloads, and scans.
 # - Supports both Active and Passive FTP modes.
 
+import atexit
+import hashlib
+import json
+import mmap
 import os
+import posixpath
+import queue
+import secrets
+import select
 import socket
 import shlex
+import struct
 import sys
 import time
 import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import readline  # Line editing, history and tab completion for the REPL.
+except ImportError:  # Not available on Windows.
+    readline = None
 
 # Import the custom FTP logic and its exceptions.
 from my_ftp import FTPClient as MyFTPClient, FTPError, FTPConnectError, FTPPermError, FTPTempError
@@ -17,16 +32,204 @@ from my_ftp import FTPClient as MyFTPClient, FTPError, FTPConnectError, FTPPermE
 # --- Global Configuration ---
 CLAMAV_AGENT_HOST = '127.0.0.1'
 CLAMAV_AGENT_PORT = 12067
-BUFFER_SIZE = 4096
+BUFFER_SIZE = 1 << 20 # Chunk size for streaming files to the ClamAV agent.
+MAX_SCAN_FILE_SIZE = 100 * 1024 * 1024 # Largest file the agent accepts (its MAX_FILE_SIZE).
+# Linux-only flag telling the kernel more data follows a send; 0 (no effect) elsewhere.
+MSG_MORE = getattr(socket, 'MSG_MORE', 0)
+# Scan verdicts are remembered by file content for VERDICT_CACHE_TTL seconds, so
+# unchanged files are rescanned once the agent may have newer signatures. Each file's
+# digest is remembered too, and only recomputed once its modification time or size changes.
+VERDICT_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.ftp_clamd_cache.json')
+VERDICT_CACHE_TTL = 3600
+VERDICT_CACHE_MAX_ENTRIES = 10000
 # --- Standardized Scan Results ---
 SCAN_RESULT_CLEAN = "OK"
 SCAN_RESULT_INFECTED_PREFIX = "INFECTED:"
 SCAN_RESULT_ERROR = "ERROR"
 SCAN_RESULT_SCAN_ERROR_PREFIX = "SCAN_ERROR:"
+SCAN_RESULT_AGENT_ERROR_PREFIX = "ERROR:"
+# Number of files mput scans ahead of the one being uploaded.
+SCAN_AHEAD = 4
+# Suffix for the temporary name a file is uploaded under until its scan comes back clean.
+UPLOAD_TEMP_SUFFIX = ".scanning"
+# Suffix for the temporary name a segmented download is written under until every range has arrived.
+DOWNLOAD_TEMP_SUFFIX = ".part"
+# REPL command history, kept between runs when readline is available.
+HISTORY_PATH = os.path.join(os.path.expanduser('~'), '.ftp_clamd_history')
+HISTORY_LENGTH = 1000
+# Seconds a remote directory listing is reused for tab completion.
+COMPLETION_CACHE_TTL = 2
+# Binary downloads at least this large are fetched as byte ranges over several connections.
+SEGMENTED_DOWNLOAD_MIN = 64 << 20
+
+
+def read_line(prompt=""):
+    """
+    Show prompt and read one line from stdin, without the trailing newline (an input()
+    replacement). It skips input()'s extra stderr flush and readline hook, and lines
+    pasted in one go are served from stdin's buffer instead of one read per line.
+    At a terminal with readline available, input() is used for its line editing,
+    history and completion.
+    """
+    if readline is not None and sys.stdin.isatty():
+        return input(prompt)
+    sys.stdout.write(prompt)
+    sys.stdout.flush()
+    line = sys.stdin.readline()
+    if not line:
+        raise EOFError
+    return line.rstrip('\r\n')
+
+
+def file_digest(path):
+    """Return the SHA-256 hex digest of a file's contents, read in BUFFER_SIZE chunks."""
+    digest = hashlib.sha256()
+    buf = bytearray(BUFFER_SIZE)
+    view = memoryview(buf)
+    with open(path, 'rb') as f:
+        while True:
+            count = f.readinto(buf)
+            if not count:
+                break
+            digest.update(view[:count])
+    return digest.hexdigest()
+
+
+class UploadAborted(Exception):
+    """Raised to abort an upload whose scan came back before it finished, and not clean."""
+
+
+class VerdictCache:
+    """
+    Recent scan verdicts keyed by the SHA-256 digest of the scanned content, kept in a
+    JSON file between runs together with the last digest of each local file. The oldest
+    entries are dropped beyond max_entries.
+
+    A file's digest is reused while its modification time, size, inode and change time
+    (ctime) are all unchanged. The modification time alone can be put back (touch -r,
+    cp -p), but ctime moves on with every change and can't be set by the user. What
+    remains is a change that keeps all four, which takes resetting the system clock or
+    writing to the raw device, and filesystems without a real ctime: on Windows st_ctime
+    is the creation time, so there a change that restores the modification time and
+    size is not noticed.
+    """
+    def __init__(self, path, ttl, max_entries):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = None  # digest -> [result, scan time], least recently used first. Loaded on first use.
+        self.digests = None  # absolute path -> [mtime in ns, size, inode, ctime in ns, digest], least recently used first.
+        self.dirty = False
+        self.lock = threading.Lock()
+
+    def _load(self):
+        if self.entries is None:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                self.entries = dict(data['verdicts'])
+                self.digests = dict(data['digests'])
+            except (OSError, ValueError, TypeError, KeyError):
+                self.entries = {}
+                self.digests = {}
+
+    @staticmethod
+    def _trim(entries, max_entries):
+        while len(entries) > max_entries:
+            del entries[next(iter(entries))]
+
+    def digest(self, file_path, file_stat):
+        """
+        Return the SHA-256 digest of file_path, whose os.stat() result is file_stat. It is
+        only computed when the file's modification time, size, inode or ctime differs from
+        last time.
+        """
+        key = os.path.abspath(file_path)
+        stamp = [file_stat.st_mtime_ns, file_stat.st_size, file_stat.st_ino, file_stat.st_ctime_ns]
+        with self.lock:
+            self._load()
+            entry = self.digests.pop(key, None)
+            if entry is not None and entry[:-1] == stamp:
+                self.digests[key] = entry
+                return entry[-1]
+        digest = file_digest(file_path)
+        # A file changed in the last couple of seconds could change again without its
+        # timestamps moving on, so its digest isn't remembered yet.
+        if time.time_ns() - max(file_stat.st_mtime_ns, file_stat.st_ctime_ns) > 2_000_000_000:
+            with self.lock:
+                self.digests[key] = stamp + [digest]
+                self._trim(self.digests, self.max_entries)
+                self.dirty = True
+        return digest
+
+    def get(self, digest):
+        """Return the cached result for digest, or None if there is none that is recent enough."""
+        with self.lock:
+            self._load()
+            entry = self.entries.pop(digest, None)
+            if entry is None or time.time() - entry[1] > self.ttl:
+                return None
+            # Re-insert to mark it as recently used.
+            self.entries[digest] = entry
+            return entry[0]
+
+    def put(self, digest, result):
+        with self.lock:
+            self._load()
+            self.entries.pop(digest, None)
+            self.entries[digest] = [result, time.time()]
+            self._trim(self.entries, self.max_entries)
+            self.dirty = True
+
+    def save(self):
+        """Write the cache back to disk if it changed. Failing to save only costs rescans."""
+        with self.lock:
+            if not self.dirty:
+                return
+            try:
+                temp_path = self.path + '.tmp'
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    json.dump({'verdicts': self.entries, 'digests': self.digests}, f)
+                os.replace(temp_path, self.path)
+                self.dirty = False
+            except OSError:
+                pass
+
+
+verdict_cache = VerdictCache(VERDICT_CACHE_PATH, VERDICT_CACHE_TTL, VERDICT_CACHE_MAX_ENTRIES)
+atexit.register(verdict_cache.save)
+
+
+class WorkerCount:
+    """
+    The number of transfer workers still running, shared between them. A worker that can't
+    get a connection of its own (e.g. the server limits connections per client) leaves
+    the work to the others, but the last one stays so the work still gets done.
+    """
+    def __init__(self, count):
+        self.count = count
+        self.lock = threading.Lock()
+
+    def leave(self):
+        """Stop counting the calling worker and return True, unless it is the last one."""
+        with self.lock:
+            if self.count <= 1:
+                return False
+            self.count -= 1
+            return True
 
 
 class FTPClient:
     """The main class that encapsulates all FTP client functionality."""
+    # Fixed attribute slots: faster attribute access than an instance dict, and a typo'd
+    # attribute name fails loudly instead of silently creating a new one.
+    __slots__ = (
+        'ftp', 'connected', 'current_dir', 'prompt_enabled', 'transfer_type',
+        'clamav_connected', '_clamav_sock', '_clamav_lock', '_creds',
+        'max_parallel_transfers', 'show_progress', '_use_mlsd', '_use_list', 'download_segments',
+        '_rest_supported', 'transfer_in_progress', '_commands', '_completion_cache', '_matches',
+    )
+
     def __init__(self):
         """Initializes the FTP client's state."""
         self.ftp = MyFTPClient()
@@ -35,7 +238,19 @@ class FTPClient:
         self.prompt_enabled = True  # For mget/mput confirmation
         self.transfer_type = 'binary'  # Global transfer mode setting
         self.clamav_connected = False
+        self._clamav_sock = None  # Persistent connection to the ClamAV agent.
+        self._clamav_lock = threading.Lock()
+        self._creds = None  # (host, port, username, password), for extra transfer connections.
+        self.max_parallel_transfers = 8  # Concurrent connections used by mget/mput.
+        self.show_progress = True  # Progress bars for uploads and downloads (SIZE is skipped without them).
+        self._use_mlsd = True  # Cleared once the server turns out not to support MLSD.
+        self._use_list = True  # Cleared once LIST turns out to be unsupported or in an unknown format.
+        self.download_segments = 5  # Connections a large download is split over.
+        self._rest_supported = None  # Whether the server resumes transfers (REST STREAM); None until asked.
         self.transfer_in_progress = False
+        self._commands = self._build_command_table()  # Command name -> handler, built once.
+        self._completion_cache = (0.0, None, [])  # (time, server directory, names) of the last listing.
+        self._matches = []  # Completions for the word being completed.
 
     # --- Connection Management ---
     def connect_ftp(self, host, username, password, port=21):
@@ -49,8 +264,15 @@ class FTPClient:
             print(f"✅ Successfully connected to {host}.")
             
             self.connected = True
-            self.current_dir = self.ftp.pwd()
-            print(f"📍 Current directory: {self.current_dir}")
+            self._creds = (host, port, username, password)
+            self._rest_supported = None
+            try:
+                self.current_dir = self.ftp.pwd()
+                print(f"📍 Current directory: {self.current_dir}")
+            except FTPError as e:
+                # Logged in all the same; the directory is asked for again when needed.
+                self.current_dir = None
+                print(f"⚠️ Could not get the current directory: {e}")
             return True
             
         except (FTPConnectError, FTPPermError, FTPTempError) as e:
@@ -64,6 +286,7 @@ class FTPClient:
 
     def disconnect_ftp(self):
         """Disconnect from FTP server."""
+        self._close_clamav()
         if self.ftp and self.connected:
             try:
                 self.ftp.quit()
@@ -75,6 +298,18 @@ class FTPClient:
         else:
             print("⚠️ Not connected to any FTP server.")
 
+    def check_connection(self):
+        """Notice, without a round-trip, if the server has dropped the connection. Returns whether still connected."""
+        if self.connected and self.ftp.connection_lost():
+            print("⚠️ The server closed the connection. Use 'open' to reconnect.")
+            self.ftp.close()
+            self.connected = False
+        return self.connected
+
+    # Bar pieces built once and sliced for each redraw.
+    _BAR_FULL = '█' * 40
+    _BAR_EMPTY = '-' * 40
+
     @staticmethod
     def show_progress_bar(current, total, prefix="Progress", length=40):
         """
@@ -91,7 +326,10 @@ class FTPClient:
         percent = min(100.0, (current / total) * 100)
         display_current = min(current, total)
         filled_length = int(length * display_current // total)
-        bar = '█' * filled_length + '-' * (length - filled_length)
+        if length <= len(FTPClient._BAR_FULL):
+            bar = FTPClient._BAR_FULL[:filled_length] + FTPClient._BAR_EMPTY[filled_length:length]
+        else:
+            bar = '█' * filled_length + '-' * (length - filled_length)
         
         # Print the progress bar string.
         print(f'\r{prefix}: |{bar}| {percent:.1f}% ({current}/{total} bytes)', end="", flush=True)
@@ -101,75 +339,209 @@ class FTPClient:
             print()
 
     # --- ClamAV Integration ---
-    def scan_file_with_clamav(self, file_path):
-        """Scan file with ClamAV agent before upload, showing progress."""
-        if not os.path.exists(file_path):
-            print(f"❌ File not found: {file_path}")
-            return SCAN_RESULT_ERROR
+    def _ensure_clamav(self):
+        """Return the connection to the ClamAV agent, opening it if there is none yet."""
+        s = self._clamav_sock
+        # An idle connection only becomes readable if the agent closed it.
+        if s is not None and select.select([s], [], [], 0)[0]:
+            self._close_clamav()
+            s = None
+        if s is None:
+            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            try:
+                # Let the kernel buffer a whole chunk so each send doesn't stall on the agent.
+                s.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, BUFFER_SIZE)
+                s.connect((CLAMAV_AGENT_HOST, CLAMAV_AGENT_PORT))
+                # The header and the verdict are small packets; don't let Nagle hold them back.
+                s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                s.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            except OSError:
+                s.close()
+                raise
+            print(f"🔬 Connected to ClamAV Agent at {CLAMAV_AGENT_HOST}:{CLAMAV_AGENT_PORT}")
+            self._clamav_sock = s
+            self.clamav_connected = True
+        return s
+
+    def _close_clamav(self):
+        """Close the connection to the ClamAV agent, if open."""
+        if self._clamav_sock is not None:
+            self._clamav_sock.close()
+            self._clamav_sock = None
+        self.clamav_connected = False
+
+    @staticmethod
+    def _recv_exact(s, n):
+        """Receive exactly n bytes from the agent; a reply may arrive in several pieces."""
+        data = bytearray(n)
+        view = memoryview(data)
+        received = 0
+        while received < n:
+            count = s.recv_into(view[received:])
+            if not count:
+                raise ConnectionResetError("ClamAV agent closed the connection.")
+            received += count
+        return data
+
+    @staticmethod
+    def _send_file_data(s, f, file_size):
+        """
+        Send the first file_size bytes of f over s, yielding the total sent after each chunk.
+        Uses sendfile() so the kernel copies the data straight from the page cache. Where
+        the OS has no sendfile() the file is memory-mapped instead, so chunks are sent
+        from the mapping without first being copied into bytes objects.
+        """
+        if hasattr(os, 'sendfile') or file_size == 0:
+            sent_bytes = 0
+            while sent_bytes < file_size:
+                sent = s.sendfile(f, sent_bytes, BUFFER_SIZE)
+                if not sent:
+                    break
+                sent_bytes += sent
+                yield sent_bytes
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+            end = min(file_size, len(mm))
+            for start in range(0, end, BUFFER_SIZE):
+                stop = min(start + BUFFER_SIZE, end)
+                s.sendall(view[start:stop])
+                yield stop
+
+    def _request_scan(self, file_path, file_name, file_size, show_progress):
+        """Send one file over the agent connection and return the agent's reply."""
+        s = self._ensure_clamav()
+
+        # Send the header in one segment: file name length (4 bytes),
+        # file name, file size (8 bytes).
+        name_bytes = file_name.encode('utf-8')
+        header = struct.pack(f'!I{len(name_bytes)}sQ', len(name_bytes), name_bytes, file_size)
+        # When file data follows, let the kernel hold the header back and send it
+        # in the same segment as the start of the data.
+        s.sendall(header, MSG_MORE if file_size else 0)
+
+        # Send the file data, updating the progress bar (at a limited rate) after each chunk.
+        sent_bytes = 0
+        progress = self.ProgressCallback(file_size, "Scan") if show_progress else None
+        try:
+            with open(file_path, "rb") as f:
+                for sent_bytes in self._send_file_data(s, f, file_size):
+                    # Update progress bar for the scan upload.
+                    if progress:
+                        progress.update(sent_bytes)
+        except (ConnectionResetError, BrokenPipeError):
+            # The agent may have refused the file and closed the connection; if so its
+            # reply says why, and sending the file again would only be refused again.
+            reply = self._read_pending_reply(s)
+            if reply is None:
+                raise
+            return reply
+        if sent_bytes < file_size:
+            # The agent is still waiting for the announced size, so the connection is unusable.
+            raise OSError(f"File shrank while being scanned: {file_path}")
+
+        # Clean up the progress bar line.
+        if show_progress and sent_bytes > 0:
+            print()
+        print("⏳ Waiting for scan result...")
+
+        # The reply is prefixed with its length (4 bytes).
+        reply_len, = struct.unpack('!I', self._recv_exact(s, 4))
+        return self._recv_exact(s, reply_len).decode('utf-8').strip()
+
+    def _read_pending_reply(self, s):
+        """Return a reply the agent sent before closing the connection, or None if there isn't one."""
+        try:
+            if not select.select([s], [], [], 0)[0]:
+                return None
+            reply_len, = struct.unpack('!I', self._recv_exact(s, 4))
+            return self._recv_exact(s, reply_len).decode('utf-8').strip()
+        except OSError:
+            return None
+
+    def scan_file_with_clamav(self, file_path, show_progress=True, file_stat=None):
+        """
+        Scan file with ClamAV agent before upload, showing progress unless show_progress is False.
+        Callers that already have the file's os.stat() result can pass it to save another stat().
+        """
+        if file_stat is None:
+            try:
+                file_stat = os.stat(file_path)
+            except FileNotFoundError:
+                print(f"❌ File not found: {file_path}")
+                return SCAN_RESULT_ERROR
+        file_size = file_stat.st_size
         
         file_name = os.path.basename(file_path)
-        file_size = os.path.getsize(file_path)
+        if file_size > MAX_SCAN_FILE_SIZE:
+            # The agent would refuse it; don't send (or hash) the file for nothing.
+            print(f"❌ {file_name} is too large to scan (limit {MAX_SCAN_FILE_SIZE >> 20} MiB).")
+            return SCAN_RESULT_ERROR
 
+        # Unchanged content scanned recently doesn't need to go to the agent again, and
+        # an unchanged file doesn't need to be read to find that out.
         try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.connect((CLAMAV_AGENT_HOST, CLAMAV_AGENT_PORT))
-                print(f"🔬 Connected to ClamAV Agent at {CLAMAV_AGENT_HOST}:{CLAMAV_AGENT_PORT}")
-
-                # Send file name length (4 bytes)
-                s.sendall(len(file_name).to_bytes(4, byteorder='big'))
-                # Send file name
-                s.sendall(file_name.encode('utf-8'))
-                # Send file size (8 bytes)
-                s.sendall(file_size.to_bytes(8, byteorder='big'))
-
-                # Send file data in chunks and update progress bar.
-                sent_bytes = 0
-                with open(file_path, "rb") as f:
-                    while True:
-                        data = f.read(BUFFER_SIZE)
-                        if not data:
-                            break
-                        s.sendall(data)
-                        sent_bytes += len(data)
-                        # Update progress bar for the scan upload.
-                        FTPClient.show_progress_bar(sent_bytes, file_size, "Scan")
-
-                # Clean up the progress bar line.
-                if sent_bytes > 0:
-                    print() 
-                print("⏳ Waiting for scan result...")
-                
-                # Receive and process the scan result from the agent.
-                result = s.recv(1024).decode('utf-8').strip()
-                print(f"🔍 Scan result for {file_name}: {result}")
-                
-                if result.startswith(SCAN_RESULT_INFECTED_PREFIX):
-                    print(f"🛑 FILE INFECTED! Virus: {result[len(SCAN_RESULT_INFECTED_PREFIX):]}")
-                    return SCAN_RESULT_INFECTED_PREFIX
-                elif result == SCAN_RESULT_CLEAN:
-                    print(f"✅ File is CLEAN.")
-                    return SCAN_RESULT_CLEAN
-                elif result.startswith(SCAN_RESULT_SCAN_ERROR_PREFIX):
-                    print(f"❌ Scan error: {result[len(SCAN_RESULT_SCAN_ERROR_PREFIX):]}")
-                    return SCAN_RESULT_ERROR
-                else:
-                    print(f"❌ Unknown scan result: {result}")
-                    return SCAN_RESULT_ERROR
-                    
+            digest = verdict_cache.digest(file_path, file_stat)
+        except OSError:
+            digest = None
+        result = verdict_cache.get(digest) if digest else None
+        if result is not None:
+            print(f"🗂️ Using cached scan result for {file_name}.")
+            return self._report_scan_result(file_name, result)
+
+        try:
+            # The agent connection is kept open between scans; one scan at a time uses it.
+            with self._clamav_lock:
+                try:
+                    result = self._request_scan(file_path, file_name, file_size, show_progress)
+                except (ConnectionResetError, ConnectionAbortedError, BrokenPipeError):
+                    # The agent may have dropped the connection since the last scan;
+                    # reconnect and try once more.
+                    self._close_clamav()
+                    result = self._request_scan(file_path, file_name, file_size, show_progress)
         except ConnectionRefusedError:
+            self._close_clamav()
             print(f"🚫 Connection to ClamAV agent at {CLAMAV_AGENT_HOST}:{CLAMAV_AGENT_PORT} refused.")
             return SCAN_RESULT_ERROR
         except Exception as e:
+            self._close_clamav()
             print(f"❌ Error communicating with ClamAV Agent: {e}")
             return SCAN_RESULT_ERROR
 
+        if digest and (result == SCAN_RESULT_CLEAN or result.startswith(SCAN_RESULT_INFECTED_PREFIX)):
+            verdict_cache.put(digest, result)
+        return self._report_scan_result(file_name, result)
+
+    @staticmethod
+    def _report_scan_result(file_name, result):
+        """Print the agent's result string and turn it into one of the standardized scan results."""
+        print(f"🔍 Scan result for {file_name}: {result}")
+        if result.startswith(SCAN_RESULT_INFECTED_PREFIX):
+            print(f"🛑 FILE INFECTED! Virus: {result[len(SCAN_RESULT_INFECTED_PREFIX):]}")
+            return SCAN_RESULT_INFECTED_PREFIX
+        elif result == SCAN_RESULT_CLEAN:
+            print(f"✅ File is CLEAN.")
+            return SCAN_RESULT_CLEAN
+        elif result.startswith(SCAN_RESULT_SCAN_ERROR_PREFIX):
+            print(f"❌ Scan error: {result[len(SCAN_RESULT_SCAN_ERROR_PREFIX):]}")
+            return SCAN_RESULT_ERROR
+        elif result.startswith(SCAN_RESULT_AGENT_ERROR_PREFIX):
+            reason = result[len(SCAN_RESULT_AGENT_ERROR_PREFIX):]
+            if reason == "TooLarge":
+                print("❌ File is too large for the ClamAV agent to scan.")
+            else:
+                print(f"❌ ClamAV agent refused the file: {reason}")
+            return SCAN_RESULT_ERROR
+        else:
+            print(f"❌ Unknown scan result: {result}")
+            return SCAN_RESULT_ERROR
+
     def set_clamav_agent_config(self):
         """Configure ClamAV agent host and port at runtime."""
         global CLAMAV_AGENT_HOST, CLAMAV_AGENT_PORT
         print("🛠️ Configure ClamAV agent (leave blank to keep current values):")
         
-        new_host = input(f"Enter ClamAV Agent Host (current: {CLAMAV_AGENT_HOST}): ").strip()
-        new_port = input(f"Enter ClamAV Agent Port (current: {CLAMAV_AGENT_PORT}): ").strip()
+        new_host = read_line(f"Enter ClamAV Agent Host (current: {CLAMAV_AGENT_HOST}): ").strip()
+        new_port = read_line(f"Enter ClamAV Agent Port (current: {CLAMAV_AGENT_PORT}): ").strip()
         
         if new_host:
             CLAMAV_AGENT_HOST = new_host
@@ -180,6 +552,8 @@ class FTPClient:
             print("❌ Invalid port number. Port must be an integer.")
             return
             
+        # The next scan connects to the new agent.
+        self._close_clamav()
         print(f"✅ ClamAV Agent configured to: {CLAMAV_AGENT_HOST}:{CLAMAV_AGENT_PORT}")
 
 
@@ -208,7 +582,8 @@ class FTPClient:
             
         try:
             self.ftp.cwd(remote_dir)
-            self.current_dir = self.ftp.pwd()
+            # cwd() follows the change locally; PWD is only sent when it couldn't (e.g. '~').
+            self.current_dir = self.ftp.pwd_cached()
             print(f"📁 Changed to directory: {self.current_dir}")
         except FTPError as e:
             print(f"❌ Failed to change directory: {e}")
@@ -295,7 +670,7 @@ class FTPClient:
             return False
             
         if not to_path:
-            to_path = input("✏️ New file name (include extension): ").strip()
+            to_path = read_line("✏️ New file name (include extension): ").strip()
             
         try:
             self.ftp.rename(from_path, to_path)
@@ -310,15 +685,32 @@ class FTPClient:
         A helper class used as a callback to track and display file transfer progress.
         An instance of this class is callable.
         """
+        __slots__ = ('file_size', 'transferred', 'operation', '_last_draw', '_last_percent')
+        # Minimum seconds between redraws, so printing doesn't slow down the transfer itself.
+        REDRAW_INTERVAL = 0.1
+
         def __init__(self, file_size, operation="Transfer"):
             self.file_size = file_size
             self.transferred = 0
             self.operation = operation
+            self._last_draw = 0.0
+            self._last_percent = -1
             
         def __call__(self, data):
             """This method is called for each chunk of data transferred."""
-            self.transferred += len(data)
-            FTPClient.show_progress_bar(self.transferred, self.file_size, self.operation)
+            self.update(self.transferred + len(data))
+
+        def update(self, transferred):
+            """Record the total number of bytes transferred so far, redrawing the bar if it is due."""
+            self.transferred = transferred
+            now = time.monotonic()
+            percent = self.transferred * 100 // self.file_size if self.file_size > 0 else -1
+            # Redraw when the percentage moves, when enough time has passed, or for the final update.
+            if (percent != self._last_percent or now - self._last_draw >= self.REDRAW_INTERVAL
+                    or self.transferred >= self.file_size > 0):
+                self._last_draw = now
+                self._last_percent = percent
+                FTPClient.show_progress_bar(self.transferred, self.file_size, self.operation)
 
     # --- Transfer Operations ---
     def upload_file(self, local_path, remote_path=None):
@@ -328,36 +720,112 @@ class FTPClient:
             return False
             
         local_path = local_path.strip('"')
-        if not os.path.exists(local_path):
+        # One stat() here serves the scan and the progress bar as well.
+        try:
+            file_stat = os.stat(local_path)
+        except FileNotFoundError:
             print(f"❌ File '{local_path}' not found")
             return False
 
-        # Step 1: Scan the file with ClamAV.
-        scan_result = self.scan_file_with_clamav(local_path)
+        if not remote_path:
+            remote_path = os.path.basename(local_path)
+
+        # The file is uploaded under a temporary name while the scan runs, and only
+        # renamed to remote_path once it is known to be clean. The random part keeps it
+        # from clashing with a real file or with another client's upload.
+        temp_remote_path = f"{remote_path}.{secrets.token_hex(8)}{UPLOAD_TEMP_SUFFIX}"
+
+        with ThreadPoolExecutor(max_workers=1) as scanner:
+            # Step 1: Scan the file with ClamAV in the background.
+            scan = scanner.submit(self.scan_file_with_clamav, local_path, show_progress=False, file_stat=file_stat)
+
+            # Step 2: Upload it at the same time.
+            try:
+                self._store_file(local_path, remote_path, temp_remote_path, file_stat.st_size, scan)
+            except UploadAborted:
+                # The scan came back first and the file isn't clean; the rest wasn't sent.
+                pass
+            except (FTPError, OSError) as e:
+                print(f"❌ Upload error: {e}")
+                scan.result()
+                self._discard_upload(temp_remote_path)
+                return False
+
+            scan_result = scan.result()
+
+        # Step 3: Keep the file only if the scan came back clean.
         if scan_result != SCAN_RESULT_CLEAN:
             print("🛑 Upload cancelled due to scan result.")
+            self._discard_upload(temp_remote_path)
             return False
 
-        # Step 2: If clean, proceed with FTP upload.
         try:
-            if not remote_path:
-                remote_path = os.path.basename(local_path)
-            file_size = os.path.getsize(local_path)
-            # Create a callback instance to track upload progress.
-            progress_callback = self.ProgressCallback(file_size, "Upload")
-
-            print(f"📤 Uploading '{local_path}' to server as '{remote_path}'...")
-            # Pass the callback to the low-level stor method.
-            self.ftp.stor(local_path, remote_path, binary=(self.transfer_type == 'binary')
-                          , callback = progress_callback)
-
+            if not self._rename_upload(temp_remote_path, remote_path):
+                return False
             print("✅ Upload successful.")
             return True
-            
         except FTPError as e:
             print(f"❌ Upload error: {e}")
+            self._discard_upload(temp_remote_path)
             return False
 
+    def _store_file(self, local_path, remote_path, target_path, file_size, scan=None):
+        """
+        Upload local_path to target_path on the server, showing progress for remote_path.
+        If the scan future comes back with anything but a clean result while the upload
+        is still going, the transfer is aborted (ABOR) and UploadAborted is raised.
+        """
+        # Create a callback instance to track upload progress.
+        progress_callback = None
+        if self.show_progress:
+            progress_callback = self.ProgressCallback(file_size, "Upload")
+
+        def callback(chunk):
+            if progress_callback:
+                progress_callback(chunk)
+            if scan is not None and scan.done() and scan.result() != SCAN_RESULT_CLEAN:
+                raise UploadAborted()
+
+        print(f"📤 Uploading '{local_path}' to server as '{remote_path}'...")
+        # Pass the callback to the low-level stor method, which aborts the transfer if it raises.
+        self.ftp.stor(local_path, target_path, binary=(self.transfer_type == 'binary')
+                      , callback = callback)
+
+    def _rename_upload(self, temp_remote_path, remote_path):
+        """
+        Rename a finished upload to remote_path, replacing any file already there. Returns
+        False, after telling the user, if the old file had to be deleted and the upload
+        then couldn't take its place; the upload is left under its temporary name then.
+        """
+        try:
+            self.ftp.rename(temp_remote_path, remote_path)
+        except FTPPermError as e:
+            # Some servers (FileZilla among them) won't rename onto an existing file.
+            # Delete the old file and try again; if there is nothing to delete, the
+            # rename failed for some other reason, so report that instead.
+            if not str(e).startswith(('550', '553')):
+                raise
+            try:
+                self.ftp.delete(remote_path)
+            except FTPPermError:
+                raise e
+            try:
+                self.ftp.rename(temp_remote_path, remote_path)
+            except (FTPError, OSError) as e:
+                # The old file is gone, so the upload is the only copy left: keep it.
+                print(f"❌ Upload error: {e}")
+                print(f"⚠️ The previous '{remote_path}' was deleted to make way for the upload, "
+                      f"which is kept on the server as '{temp_remote_path}'.")
+                return False
+        return True
+
+    def _discard_upload(self, temp_remote_path):
+        """Delete a temporary upload from the server, if it got that far."""
+        try:
+            self.ftp.delete(temp_remote_path)
+        except (FTPError, OSError) as e:
+            print(f"⚠️ Could not delete '{temp_remote_path}' from the server ({e}); please remove it by hand.")
+
     def download_file(self, remote_path, local_path=None):
         """Download single file from server with progress bar."""
         if not self.connected:
@@ -368,23 +836,117 @@ class FTPClient:
             if not local_path:
                 local_path = os.path.basename(remote_path)
 
-            # Get the size of the remote file for the progress bar.
-            file_size = self.ftp.size(remote_path)
-            # Create a callback instance to track download progress.
-            progress_callback = self.ProgressCallback(file_size, "Download")
+            binary = self.transfer_type == 'binary'
+            segmented = binary and self.download_segments > 1
+            file_size = 0
+            if self.show_progress or segmented:
+                # Get the size of the remote file for the progress bar and to decide whether
+                # to split the download. It costs a round-trip, so it is only asked for then.
+                try:
+                    file_size = self.ftp.size(remote_path)
+                except FTPError:
+                    # SIZE isn't supported everywhere (or in ASCII mode); show bytes only.
+                    file_size = 0
+
+            progress_callback = None
+            if self.show_progress:
+                # Create a callback instance to track download progress.
+                progress_callback = self.ProgressCallback(file_size, "Download")
 
             print(f"⬇️ Downloading '{remote_path}' from server...")     
-            # Pass the callback to the low-level retr method.       
-            self.ftp.retr(remote_path, local_path, binary=(self.transfer_type == 'binary')
-                          , callback = progress_callback)
+            if segmented and file_size >= SEGMENTED_DOWNLOAD_MIN and self._server_supports_rest():
+                self._download_segmented(remote_path, local_path, file_size, progress_callback)
+            else:
+                # Pass the callback to the low-level retr method.
+                self.ftp.retr(remote_path, local_path, binary=binary, callback = progress_callback)
+            if progress_callback and progress_callback.file_size <= 0:
+                # The byte counter doesn't end its own line.
+                print()
                     
             print(f"✅ Downloaded: {remote_path} to {local_path}")
             return True
             
-        except FTPError as e:
+        except (FTPError, OSError) as e:
             print(f"\n❌ Download failed: {e}")
             return False
 
+    def _server_supports_rest(self):
+        """Whether the server can start a transfer at an offset, going by its FEAT reply (asked once)."""
+        if self._rest_supported is None:
+            try:
+                features = self.ftp.voidcmd("FEAT")
+            except FTPError:
+                features = ""
+            self._rest_supported = "REST STREAM" in features.upper()
+        return self._rest_supported
+
+    def _download_segmented(self, remote_path, local_path, file_size, callback=None):
+        """
+        Download remote_path in download_segments byte ranges at once, each over a connection
+        of its own and written in place in a temporary file, which replaces local_path once
+        every range has arrived. A single TCP stream often can't fill a long, fast link; several can.
+        """
+        part_size = -(-file_size // self.download_segments)
+        ranges = [(offset, min(part_size, file_size - offset)) for offset in range(0, file_size, part_size)]
+        # An existing local_path is left alone until the whole file is here.
+        temp_path = f"{local_path}.{secrets.token_hex(8)}{DOWNLOAD_TEMP_SUFFIX}"
+
+        progress = None
+        if callback:
+            progress_lock = threading.Lock()
+
+            def progress(chunk):
+                with progress_lock:
+                    callback(chunk)
+
+        def fetch(offset, length):
+            ftp = self._open_transfer_connection()
+            try:
+                ftp.retr_range(remote_path, temp_path, offset, length, callback=progress)
+            finally:
+                self._close_transfer_connection(ftp)
+
+        try:
+            # Give the file its full size up front so every range can be written at its offset.
+            with open(temp_path, 'wb') as f:
+                f.truncate(file_size)
+            with ThreadPoolExecutor(max_workers=len(ranges)) as pool:
+                futures = [pool.submit(fetch, offset, length) for offset, length in ranges]
+                try:
+                    for future in futures:
+                        future.result()
+                except BaseException:
+                    # Don't start ranges that are no longer needed; leaving the with block
+                    # waits for the ones already running before the file is removed.
+                    for future in futures:
+                        future.cancel()
+                    raise
+            os.replace(temp_path, local_path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+
+    @staticmethod
+    def _scan_local_files(local_dir, recursive, dir_components=()):
+        """
+        Yield (local_path, dir_components, file_name) for the files in local_dir (and its
+        sub-directories if recursive), where dir_components are the names of the directories
+        between local_dir and the file. os.scandir() entries know their own type, so no
+        extra stat() is needed per file.
+        """
+        with os.scandir(local_dir) as entries:
+            subdirs = []
+            for entry in entries:
+                if entry.is_file():
+                    yield entry.path, dir_components, entry.name
+                elif recursive and entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry)
+        for subdir in subdirs:
+            yield from FTPClient._scan_local_files(subdir.path, recursive, dir_components + (subdir.name,))
+
     def upload_files(self, local_dir=None):
         """Upload multiple files from local directory (mput functionality)."""
         if not self.connected:
@@ -393,7 +955,7 @@ class FTPClient:
             
         print("📤 Multi-file upload")
         if not local_dir:
-            local_dir = input("📁 Enter local folder to upload from (or drag and drop): ").strip().strip('"')
+            local_dir = read_line("📁 Enter local folder to upload from (or drag and drop): ").strip().strip('"')
             
         if not local_dir:
             local_dir = '.'
@@ -402,111 +964,292 @@ class FTPClient:
             print(f"❌ Folder not found or invalid: {local_dir}")
             return
 
-        recursive = input("⬆️ Recursively upload sub-directories? [Y/N]: ").strip().lower() == 'y'
+        recursive = read_line("⬆️ Recursively upload sub-directories? [Y/N]: ").strip().lower() == 'y'
         
-        original_server_dir = self.ftp.pwd()
-        success_count = 0
-        fail_count = 0
-
-        # Build a list of all files to be uploaded.
-        files_to_upload = []
-        if recursive:
-            for dirpath, _, filenames in os.walk(local_dir):
-                for f in filenames:
-                    files_to_upload.append(os.path.join(dirpath, f))
-        else:
-            for f in os.listdir(local_dir):
-                full_path = os.path.join(local_dir, f)
-                if os.path.isfile(full_path):
-                    files_to_upload.append(full_path)
-
-        # Process each file in the list.
-        for local_full_path in files_to_upload:
-            if self.prompt_enabled:
-                confirm = input(f"⬆️ Upload {local_full_path}? [Y/N]: ").strip().lower()
+        try:
+            original_server_dir = self.ftp.pwd_cached()
+        except FTPError as e:
+            print(f"❌ Error getting current directory: {e}")
+            return
+
+        if self.prompt_enabled:
+            # Ask about each file up front, so the scans and uploads can run in the background.
+            files_to_upload = []
+            for upload in self._scan_local_files(local_dir, recursive):
+                confirm = read_line(f"⬆️ Upload {upload[0]}? [Y/N]: ").strip().lower()
                 if confirm != 'y':
-                    print(f"⏭️ Skipped: {local_full_path}")
+                    print(f"⏭️ Skipped: {upload[0]}")
                     continue
+                files_to_upload.append(upload)
+            workers = min(self.max_parallel_transfers, len(files_to_upload))
+        else:
+            # Nothing to ask: walk the folder on the scanner thread as it goes, so the
+            # first uploads start before a large tree has been listed.
+            files_to_upload = self._scan_local_files(local_dir, recursive)
+            workers = self.max_parallel_transfers
 
+        # Scan the files on a background thread, in order, and hand each one with its
+        # verdict to a pool of upload workers with FTP connections of their own, so
+        # scans overlap uploads and uploads overlap each other. The queue keeps the
+        # scanner at most SCAN_AHEAD files ahead of the workers.
+        jobs = queue.Queue(maxsize=SCAN_AHEAD + workers)
+        # The scanner also recreates the directory structure on the server, on the main
+        # connection, before queueing the first file of each directory.
+        made_dirs = {()}  # The base directory itself exists already.
+        failed_dirs = set()
+        total = 0
+
+        def scan_ahead():
+            nonlocal total
             try:
-                # Create the same directory structure on the server.
-                relative_path = os.path.relpath(local_full_path, local_dir)
-                remote_dir_part = os.path.dirname(relative_path)
-                remote_filename = os.path.basename(relative_path)
-
-                if remote_dir_part:
-                    # Create parent directories if they don't exist.
-                    remote_dir_part_unix = remote_dir_part.replace('\\', '/')
-                    dir_components = remote_dir_part_unix.split('/')
-                    
-                    for component in dir_components:
-                        try:
-                            self.ftp.cwd(component)
-                        except Exception:
-                            try:
-                                self.ftp.mkd(component)
-                                self.ftp.cwd(component)
-                            except Exception as e:
-                                print(f"❌ Failed to create/access remote directory '{component}': {e}")
-                                raise e
-
-                print(f"🌍 Server CWD is now: {self.ftp.pwd()}")
-                if self.upload_file(local_full_path, remote_filename):
-                    success_count += 1
-                else:
-                    fail_count += 1
+                for upload in files_to_upload:
+                    total += 1
+                    if upload[1] not in made_dirs:
+                        self._make_remote_dirs(original_server_dir, upload[1], made_dirs, failed_dirs)
+                    jobs.put((upload, self.scan_file_with_clamav(upload[0], show_progress=False)))
+            except OSError as e:
+                print(f"❌ Error listing local files: {e}")
 
-            except Exception as e:
-                print(f"❌ Failed to upload {local_full_path}: {e}")
-                fail_count += 1
-            finally:
-                # IMPORTANT: Always return to the starting directory on the server.
+        uploaded = []
+        infected = []
+        scan_errors = []
+        worker_count = WorkerCount(workers)
+        scanner = threading.Thread(target=scan_ahead, daemon=True)
+        scanner.start()
+        try:
+            with ThreadPoolExecutor(max_workers=workers or 1) as pool:
+                for _ in range(workers):
+                    pool.submit(self._upload_worker, jobs, original_server_dir, failed_dirs,
+                                uploaded, infected, scan_errors, worker_count)
                 try:
-                    self.ftp.cwd(original_server_dir)
-                except Exception as e:
-                    print(f"⚠️ Warning: Failed to return to original server directory: {e}")
+                    # Every file is queued once the scanner ends; then wait until the workers
+                    # are done with them, including any handed back by a worker that stopped.
+                    scanner.join()
+                    jobs.join()
+                finally:
+                    # One end marker per worker, however the wait ended, so the pool can shut down.
+                    for _ in range(workers):
+                        jobs.put(None)
+        finally:
+            verdict_cache.save()
 
-        print(f"\n✅ Upload finished. Success: {success_count}, Failed: {fail_count}")
+        failed = total - len(uploaded) - len(infected) - len(scan_errors)
+        print(f"\n✅ Upload finished. Success: {len(uploaded)}, Infected: {len(infected)}, "
+              f"Scan errors: {len(scan_errors)}, Failed: {failed}")
 
-    def download_directory_recursively(self, remote_dir, local_dir):
-        """Helper function to recursively download a directory."""
-        try:
-            os.makedirs(local_dir, exist_ok=True)
-            print(f"📂 Syncing remote '{remote_dir}' to local '{os.path.abspath(local_dir)}'")
-            
-            original_server_dir = self.ftp.pwd()
-            
+    def _make_remote_dirs(self, base_dir, dir_components, made, failed):
+        """
+        Create the directory named by dir_components (a tuple of path components) under
+        base_dir on the server, along with its parents. Directories in made are skipped; the
+        rest are added to it, and those that can't be used are added to failed as well.
+        """
+        # Include every parent, and create parents before their children.
+        all_dirs = {dir_components[:i] for i in range(1, len(dir_components) + 1)} - made
+        for components in sorted(all_dirs):
+            made.add(components)
+            if components[:-1] in failed:
+                failed.add(components)
+                continue
+            path = posixpath.join(base_dir, *components)
             try:
-                self.ftp.cwd(remote_dir)
-            except Exception as e:
-                print(f"❌ Failed to enter remote directory '{remote_dir}': {e}")
-                return
-            
-            print(f"📁 Processing server directory: {self.ftp.pwd()}")
-            # Get a list of items (files and directories) in the current remote dir.
-            items = self.ftp.nlst()
+                self.ftp.mkd(path)
+            except FTPError as e:
+                # Usually the directory exists already; make sure it is one.
+                try:
+                    is_dir = self.ftp.is_dir(path)
+                except FTPError:
+                    is_dir = False
+                if not is_dir:
+                    print(f"❌ Failed to create/access remote directory '{path}': {e}")
+                    failed.add(components)
 
-            for item_name in items:
+    def _upload_worker(self, jobs, base_dir, failed_dirs, uploaded, infected, scan_errors, workers):
+        """
+        Upload clean files from the jobs queue over a connection of its own until it gets None.
+        Files that aren't uploaded because of their scan result go to infected or scan_errors.
+        Stops early, handing its job back, if it can't get a connection while other workers
+        (counted by workers) remain.
+        """
+        ftp = None
+        while True:
+            job = jobs.get()
+            if job is None:
+                break
+            try:
+                (local_path, dir_components, file_name), scan_result = job
+                if scan_result != SCAN_RESULT_CLEAN:
+                    print(f"🛑 Not uploading {local_path} due to scan result.")
+                    if scan_result == SCAN_RESULT_INFECTED_PREFIX:
+                        infected.append(local_path)
+                    else:
+                        scan_errors.append(local_path)
+                    continue
+                if dir_components in failed_dirs:
+                    print(f"❌ Failed to upload {local_path}: remote directory unavailable.")
+                    continue
+                remote_path = posixpath.join(base_dir, *dir_components, file_name)
+                if ftp is None:
+                    try:
+                        ftp = self._open_transfer_connection()
+                    except (FTPError, OSError) as e:
+                        if workers.leave():
+                            print(f"⚠️ Could not open another connection ({e}); continuing with fewer.")
+                            # Queued before this job's task_done(), so jobs.join() waits for it.
+                            jobs.put(job)
+                            return
+                        print(f"❌ Failed to upload {local_path}: {e}")
+                        continue
                 try:
-                    # Check if an item is a directory by trying to change into it.
-                    self.ftp.cwd(item_name)
-                    self.ftp.cwd('..') # If successful, change back immediately.
-                    # It's a directory, so recurse.
-                    new_local_dir = os.path.join(local_dir, item_name)
-                    self.download_directory_recursively(item_name, new_local_dir)
+                    ftp.stor(local_path, remote_path, binary=(self.transfer_type == 'binary'))
+                    print(f"✅ Uploaded: {local_path} to {remote_path}")
+                    uploaded.append(local_path)
+                except Exception as e:
+                    # Anything else (e.g. a text file that isn't valid UTF-8 in ASCII mode) fails
+                    # just this file: a worker that died would leave the queue unfinished.
+                    print(f"❌ Failed to upload {local_path}: {e}")
+                    # The connection may be mid-transfer; use a fresh one for the next file.
+                    self._close_transfer_connection(ftp)
+                    ftp = None
+            finally:
+                jobs.task_done()
+        if ftp is not None:
+            self._close_transfer_connection(ftp)
+
+    def _list_remote_dir(self, ftp, server_dir, local_dir, jobs):
+        """
+        List server_dir on ftp and queue a job for every file and subdirectory in it.
+        The directory is entered by its absolute path, so no CWD is needed to come back.
+        """
+        os.makedirs(local_dir, exist_ok=True)
+        print(f"📁 Processing server directory: {server_dir}")
+        ftp.cwd(server_dir)
+        base = server_dir.rstrip('/')
+
+        for item_name, is_dir in self._list_with_types(ftp):
+            if is_dir is None:
+                # The listing didn't say; check whether the item is a directory by
+                # trying to change into it.
+                try:
+                    ftp.cwd(item_name)
                 except FTPPermError:
-                    # If CWD failed, it's a file. Download it.
-                    local_file_path = os.path.join(local_dir, item_name)
-                    self.download_file(item_name, local_file_path)
-            # Go back up to the parent directory on the server.
-            self.ftp.cwd(original_server_dir)
-
-        except (FTPPermError, FTPError) as e:
-            print(f"❌ Error processing directory '{remote_dir}': {e}")
+                    # If CWD failed, it's a file.
+                    is_dir = False
+                else:
+                    is_dir = True
+                    ftp.cwd(server_dir)
+            jobs.put((f"{base}/{item_name}", os.path.join(local_dir, item_name), is_dir))
+
+    def _list_with_types(self, ftp=None):
+        """
+        List the current server directory of ftp (the main connection by default) as
+        (name, is_dir) tuples, where is_dir is None if the listing doesn't tell. MLSD and
+        LIST both give the types in one listing; failing those, NLST gives just the names.
+        """
+        if ftp is None:
+            ftp = self.ftp
+        if self._use_mlsd:
             try:
-                self.ftp.cwd(original_server_dir)
-            except FTPError:
-                pass
+                entries = ftp.mlsd()
+            except FTPPermError as e:
+                # Only "not implemented" means the server has no MLSD; anything else (e.g. 550
+                # for this directory) is about this listing and is passed on to the caller.
+                if not str(e).startswith(('500', '502')):
+                    raise
+                self._use_mlsd = False
+            else:
+                # Only file and dir are certain; anything else (a symlink such as
+                # 'OS.unix=slink:...', or no type at all) is left for the CWD probe, like LIST
+                # does. cdir and pdir are the directory itself and its parent.
+                types = [(name, facts.get('type', '').lower()) for name, facts in entries]
+                is_dir = {'file': False, 'dir': True}
+                return [(name, is_dir.get(item_type)) for name, item_type in types
+                        if item_type not in ('cdir', 'pdir')]
+
+        if self._use_list:
+            try:
+                entries = ftp.list_dir()
+            except FTPPermError as e:
+                if not str(e).startswith(('500', '502')):
+                    raise
+                entries = None
+            if entries is not None:
+                return entries
+            # Not supported, or not in a format list_dir() understands.
+            self._use_list = False
+
+        return [(name, None) for name in ftp.nlst()]
+
+    def _open_transfer_connection(self):
+        """Open an extra logged-in FTP connection with the current settings, for parallel transfers."""
+        host, port, username, password = self._creds
+        ftp = MyFTPClient()
+        ftp.pipelining = self.ftp.pipelining
+        try:
+            ftp.connect(host, port)
+            ftp.login(username, password)
+        except (FTPError, OSError):
+            # Don't leave the socket open when the server turns the connection away.
+            ftp.close()
+            raise
+        ftp.set_pasv(self.ftp.passive_mode)
+        # Same server, so no need to find out again whether it accepts EPSV.
+        ftp.epsv_supported = self.ftp.epsv_supported
+        return ftp
+
+    def _download_worker(self, jobs, downloaded, failed, workers):
+        """
+        Take (remote_path, local_path, is_dir) jobs from the jobs queue until it gets None,
+        over a connection of its own. Files are downloaded; directories are listed and
+        their contents queued as further jobs. Stops early, handing its job back, if it
+        can't get a connection while other workers (counted by workers) remain.
+        """
+        ftp = None
+        while True:
+            job = jobs.get()
+            if job is None:
+                break
+            remote_path, local_path, is_dir = job
+            try:
+                if ftp is None:
+                    try:
+                        ftp = self._open_transfer_connection()
+                    except (FTPError, OSError) as e:
+                        if not workers.leave():
+                            raise
+                        print(f"⚠️ Could not open another connection ({e}); continuing with fewer.")
+                        # Queued before this job's task_done(), so jobs.join() waits for it.
+                        jobs.put(job)
+                        return
+                if is_dir:
+                    self._list_remote_dir(ftp, remote_path, local_path, jobs)
+                else:
+                    ftp.retr(remote_path, local_path, binary=(self.transfer_type == 'binary'))
+                    print(f"✅ Downloaded: {remote_path} to {local_path}")
+                    downloaded.append(remote_path)
+            except (FTPError, OSError) as e:
+                if is_dir:
+                    print(f"❌ Error processing directory '{remote_path}': {e}")
+                else:
+                    print(f"❌ Download failed: {remote_path}: {e}")
+                failed.append(remote_path)
+                # The connection may be mid-transfer; use a fresh one for the next job.
+                if ftp is not None:
+                    self._close_transfer_connection(ftp)
+                    ftp = None
+            finally:
+                # Jobs for the directory's contents were queued before this, so the
+                # queue can't run empty while there is still a directory to list.
+                jobs.task_done()
+        if ftp is not None:
+            self._close_transfer_connection(ftp)
+
+    @staticmethod
+    def _close_transfer_connection(ftp):
+        """Close a transfer connection, ignoring errors from a connection that is already broken."""
+        try:
+            ftp.quit()
+        except (FTPError, OSError):
+            pass
 
     def download_files(self, remote_target):
         """Download a full directory recursively (mget functionality)."""
@@ -516,31 +1259,67 @@ class FTPClient:
             
         print(f"📥 Multi-file/Directory download for: '{remote_target}'")
         
-        local_destination = input(f"📁 Enter local folder to save into (default: ./{remote_target}): ").strip()
+        local_destination = read_line(f"📁 Enter local folder to save into (default: ./{remote_target}): ").strip()
         if not local_destination:
             local_destination = remote_target.split('/')[-1]
 
-        original_server_dir = self.ftp.pwd()
+        try:
+            original_server_dir = self.ftp.pwd_cached()
+        except FTPError as e:
+            print(f"❌ Error getting current directory: {e}")
+            return
         print(f"Files will be saved to '{os.path.abspath(local_destination)}'")
 
-        success = True
-
+        # Resolve the target to an absolute path on the main connection.
         try:
-            self.download_directory_recursively(remote_target, local_destination)
-        except Exception as e:
-            print(f"❌ A critical error occurred during download: {e}")
-            success = False
+            self.ftp.cwd(remote_target)
+            root_dir = self.ftp.pwd_cached()
+        except FTPError as e:
+            print(f"❌ Error processing directory '{remote_target}': {e}")
+            return
         finally:
             try:
                 self.ftp.cwd(original_server_dir)
             except FTPError as e:
                 print(f"⚠️ Warning: Could not return to original server directory '{original_server_dir}': {e}")
-                success = False
-                
-        if success:
-            print("\n✅ Download finished.")
+
+        # A pool of workers with connections of their own takes directories and files from
+        # one queue, breadth first. Listing a directory queues its contents, so listings
+        # on one connection overlap with listings and downloads on the others, and there
+        # is no recursion or CWD back out of each directory. A worker only logs in once it
+        # gets its first job.
+        jobs = queue.Queue()
+        jobs.put((root_dir, local_destination, True))
+        downloaded = []
+        failed = []
+
+        workers = self.max_parallel_transfers
+        worker_count = WorkerCount(workers)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for _ in range(workers):
+                pool.submit(self._download_worker, jobs, downloaded, failed, worker_count)
+            try:
+                # Wait until every queued job, including those queued by the workers, is done.
+                jobs.join()
+            except BaseException:
+                # Interrupted (e.g. Ctrl+C): drop the jobs not started yet, so the workers stop
+                # after the ones they are on.
+                try:
+                    while True:
+                        jobs.get_nowait()
+                        jobs.task_done()
+                except queue.Empty:
+                    pass
+                raise
+            finally:
+                # One end marker per worker, however the wait ended, so the pool can shut down.
+                for _ in range(workers):
+                    jobs.put(None)
+
+        if not failed:
+            print(f"\n✅ Download finished. Files: {len(downloaded)}")
         else:
-            print("\n⚠️ Download completed with errors.")
+            print(f"\n⚠️ Download completed with errors. Success: {len(downloaded)}, Failed: {len(failed)}")
 
     # --- Settings and Configuration ---
     def toggle_passive_mode(self, mode=None):
@@ -562,6 +1341,34 @@ class FTPClient:
             
         print(f"🌐 Passive mode {'ON' if self.ftp.passive_mode else 'OFF'}")
 
+    def toggle_pipelining(self, mode=None):
+        """Toggle or set sending a transfer's setup commands together with it."""
+        if mode is None:
+            self.ftp.pipelining = not self.ftp.pipelining
+        elif mode.lower() == 'on':
+            self.ftp.pipelining = True
+        elif mode.lower() == 'off':
+            self.ftp.pipelining = False
+        else:
+            print("❓ Usage: pipeline <on/off>")
+            return
+
+        print(f"🚀 Command pipelining {'ON' if self.ftp.pipelining else 'OFF'}")
+
+    def toggle_progress(self, mode=None):
+        """Toggle or set the progress bars for get and put."""
+        if mode is None:
+            self.show_progress = not self.show_progress
+        elif mode.lower() == 'on':
+            self.show_progress = True
+        elif mode.lower() == 'off':
+            self.show_progress = False
+        else:
+            print("❓ Usage: progress <on/off>")
+            return
+
+        print(f"📊 Progress bars {'ON' if self.show_progress else 'OFF'}")
+
     def set_transfer_mode(self, mode):
         """Set global transfer mode (ascii/binary)."""
         if mode.lower() == 'binary':
@@ -586,6 +1393,21 @@ class FTPClient:
         self.prompt_enabled = not self.prompt_enabled
         print(f"🔁 Prompting is now {'✅ ON' if self.prompt_enabled else '🚫 OFF'} for mget/mput operations.")
 
+    def set_parallel_transfers(self, count=None):
+        """Show or set how many files mget/mput transfer at once."""
+        if count is None:
+            print(f"🔀 Parallel transfers: {self.max_parallel_transfers}")
+            return
+        try:
+            count = int(count)
+        except ValueError:
+            count = 0
+        if count < 1:
+            print("❌ The number of parallel transfers must be a positive integer.")
+            return
+        self.max_parallel_transfers = count
+        print(f"🔀 mget/mput will now transfer up to {count} files at once.")
+
     def show_status(self):
         """Show current session status."""
         if not self.connected:
@@ -598,7 +1420,10 @@ class FTPClient:
             print(f"📍 Current directory: {self.ftp.pwd()}")
             print(f"🔄 Transfer mode: {self.transfer_type}")
             print(f"🌐 Passive mode: {'ON' if self.ftp.passive_mode else 'OFF'}")
+            print(f"🚀 Command pipelining: {'ON' if self.ftp.pipelining else 'OFF'}")
+            print(f"📊 Progress bars: {'ON' if self.show_progress else 'OFF'}")
             print(f"🔁 Prompting: {'ON' if self.prompt_enabled else 'OFF'}")
+            print(f"🔀 Parallel transfers: {self.max_parallel_transfers}")
             print(f"🔬 ClamAV Agent: {CLAMAV_AGENT_HOST}:{CLAMAV_AGENT_PORT}")
         except FTPError as e:
             print(f"❌ FTP connection is closed or broken: {e}")
@@ -617,13 +1442,16 @@ class FTPClient:
             'rename <file>     Rename a file on server\n'
             '--- Transfer Commands ---\n'
             'get <rem> [loc]   Download a single file (remote to local)\n'
-            'put <loc>         Upload a single file (local to remote), scans first\n'
+            'put <loc>         Upload a single file (local to remote), kept only if the scan is clean\n'
             'mget <rem_dir>    Download a full directory recursively\n'
             'mput [loc_dir]    Upload multiple files from a local directory\n'
             '--- Settings ---\n'
             'prompt            Toggle confirmation for mget/mput\n'
             'ascii/binary      Set file transfer mode\n'
             'passive <on/off>  Toggle passive FTP mode\n'
+            'pipeline <on/off> Send dependent commands in one go\n'
+            'progress <on/off> Show progress bars for get/put\n'
+            'parallel [n]      Show or set the files mget/mput transfer at once\n'
             'set_clamav_agent  Set ClamAV agent host and port\n'
             '--- General ---\n'
             'open <host> <port> <user> <pass>  Connect to FTP server\n'
@@ -640,7 +1468,12 @@ class FTPClient:
             return True
             
         try:
-            parts = shlex.split(command)
+            # Without quotes or backslashes shlex would only split on whitespace,
+            # so skip building a lexer for the common case.
+            if '"' in command or "'" in command or '\\' in command:
+                parts = shlex.split(command)
+            else:
+                parts = command.split()
         except ValueError as e:
             print(f"❌ Invalid command syntax: {e}")
             return True
@@ -648,125 +1481,247 @@ class FTPClient:
         cmd = parts[0].lower()
         args = parts[1:]
 
+        handler = self._commands.get(cmd)
+        if handler is None:
+            print(f"❓ Unknown command: {cmd}. Type 'help' for available commands.")
+            return True
+
         try:
-            if cmd in ('quit', 'bye'):
-                self.disconnect_ftp()
-                print("👋 Exiting. Goodbye!")
+            # Handlers return False only when it's time to exit.
+            if handler(args) is False:
                 return False
-                
-            elif cmd == 'open':
-                if len(args) < 4:
-                    print("Usage: open <host> <port> <username> <password>")
-                    return True
-                host, port, username, password = args[0], int(args[1]), args[2], args[3]
-                self.connect_ftp(host, username, password, port)
-                
-            elif cmd == 'close':
-                self.disconnect_ftp()
-                
-            elif cmd == 'ls':
-                self.list_files()
-                
-            elif cmd == 'cd':
-                if args:
-                    self.change_directory(args[0])
-                else:
-                    print("Usage: cd <directory>")
-                    
-            elif cmd == 'pwd':
-                self.print_working_directory()
-                
-            elif cmd == 'lcd':
-                if args:
-                    self.local_change_directory(args[0])
-                else:
-                    print("Usage: lcd <directory>")
-                    print(f"Current local directory: {os.getcwd()}")
-                    
-            elif cmd == 'mkdir':
-                if args:
-                    self.make_directory(args[0])
-                else:
-                    print("Usage: mkdir <directory>")
-                    
-            elif cmd == 'rmdir':
-                if args:
-                    self.remove_directory(args[0])
-                else:
-                    print("Usage: rmdir <directory>")
-                    
-            elif cmd == 'delete':
-                if args:
-                    self.delete_file(args[0])
-                else:
-                    print("Usage: delete <filename>")
-                    
-            elif cmd == 'rename':
-                if len(args) >= 2:
-                    self.rename_item(args[0], args[1])
-                elif len(args) == 1:
-                    self.rename_item(args[0])
-                else:
-                    print("Usage: rename <old_name> [new_name]")
-                    
-            elif cmd in ('get', 'recv'):
-                if args:
-                    local_path = args[1] if len(args) > 1 else None
-                    self.download_file(args[0], local_path)
-                else:
-                    print("Usage: get <remote_filename> [local_filename]")
-                    
-            elif cmd == 'put':
-                if args:
-                    remote_path = args[1] if len(args) > 1 else None
-                    self.upload_file(args[0], remote_path)
-                else:
-                    print("Usage: put <local_filename> [remote_filename]")
-                    
-            elif cmd == 'mget':
-                if args:
-                    self.download_files(args[0])
-                else:
-                    print("Usage: mget <remote_directory>")
-                    
-            elif cmd == 'mput':
-                local_dir = args[0] if args else None
-                self.upload_files(local_dir)
-                
-            elif cmd == 'prompt':
-                self.toggle_prompt()
-                
-            elif cmd == 'ascii':
-                self.set_transfer_mode('ascii')
-                
-            elif cmd == 'binary':
-                self.set_transfer_mode('binary')
-                
-            elif cmd == 'passive':
-                mode = args[0] if args else None
-                self.toggle_passive_mode(mode)
-                
-            elif cmd == 'status':
-                self.show_status()
-                
-            elif cmd == 'set_clamav_agent':
-                self.set_clamav_agent_config()
-                
-            elif cmd in ('help', '?'):
-                self.show_help()
-                
-            else:
-                print(f"❓ Unknown command: {cmd}. Type 'help' for available commands.")
-                
         except Exception as e:
             print(f"❌ Error processing command '{cmd}': {e}")
             
         return True
 
+    def _build_command_table(self):
+        """Map each command name (and alias) to the method handling it, for handle_command."""
+        return {
+            'quit': self._cmd_quit,
+            'bye': self._cmd_quit,
+            'open': self._cmd_open,
+            'close': self._cmd_close,
+            'ls': self._cmd_ls,
+            'cd': self._cmd_cd,
+            'pwd': self._cmd_pwd,
+            'lcd': self._cmd_lcd,
+            'mkdir': self._cmd_mkdir,
+            'rmdir': self._cmd_rmdir,
+            'delete': self._cmd_delete,
+            'rename': self._cmd_rename,
+            'get': self._cmd_get,
+            'recv': self._cmd_get,
+            'put': self._cmd_put,
+            'mget': self._cmd_mget,
+            'mput': self._cmd_mput,
+            'prompt': self._cmd_prompt,
+            'ascii': self._cmd_ascii,
+            'binary': self._cmd_binary,
+            'passive': self._cmd_passive,
+            'pipeline': self._cmd_pipeline,
+            'progress': self._cmd_progress,
+            'parallel': self._cmd_parallel,
+            'status': self._cmd_status,
+            'set_clamav_agent': self._cmd_set_clamav_agent,
+            'help': self._cmd_help,
+            '?': self._cmd_help,
+        }
+
+    # --- Tab Completion ---
+    # Commands whose argument is a name on the server, and those whose argument is a local path.
+    _REMOTE_ARG_COMMANDS = {'cd', 'rmdir', 'delete', 'rename', 'get', 'recv', 'mget'}
+    _LOCAL_ARG_COMMANDS = {'lcd', 'put', 'mput'}
+
+    def enable_completion(self):
+        """Turn on readline tab completion and persistent history, when readline is available."""
+        if readline is None:
+            return
+        if 'libedit' in (readline.__doc__ or ''):
+            readline.parse_and_bind('bind ^I rl_complete')  # macOS ships libedit instead of GNU readline.
+        else:
+            readline.parse_and_bind('tab: complete')
+        # Complete whole paths rather than stopping at '/' or '-'.
+        readline.set_completer_delims(' \t\n')
+        readline.set_completer(self._complete)
+        try:
+            readline.read_history_file(HISTORY_PATH)
+        except OSError:
+            pass  # No history yet.
+        readline.set_history_length(HISTORY_LENGTH)
+        atexit.register(self._save_history)
+
+    @staticmethod
+    def _save_history():
+        try:
+            readline.write_history_file(HISTORY_PATH)
+        except OSError:
+            pass
+
+    def _complete(self, text, state):
+        """readline completer: command names first, then server or local names depending on the command."""
+        if state == 0:
+            words = readline.get_line_buffer()[:readline.get_begidx()].split()
+            if not words:
+                candidates = self._commands
+            elif words[0].lower() in self._REMOTE_ARG_COMMANDS:
+                candidates = self._remote_names()
+            elif words[0].lower() in self._LOCAL_ARG_COMMANDS:
+                candidates = self._local_names(text)
+            else:
+                candidates = ()
+            self._matches = sorted(name for name in candidates if name.startswith(text))
+        return self._matches[state] if state < len(self._matches) else None
+
+    def _remote_names(self):
+        """Names in the current server directory, listed at most once per COMPLETION_CACHE_TTL seconds."""
+        if not self.connected:
+            return []
+        listed_at, listed_dir, names = self._completion_cache
+        try:
+            server_dir = self.ftp.pwd_cached()
+        except (FTPError, OSError):
+            return []
+        if listed_dir != server_dir or time.monotonic() - listed_at > COMPLETION_CACHE_TTL:
+            try:
+                names = self.ftp.nlst()
+            except (FTPError, OSError):
+                names = []
+            self._completion_cache = (time.monotonic(), server_dir, names)
+        return names
+
+    @staticmethod
+    def _local_names(text):
+        """Local paths starting with text, with a trailing '/' on directories."""
+        directory, _ = os.path.split(text)
+        try:
+            entries = os.scandir(directory or '.')
+        except OSError:
+            return []
+        with entries:
+            return [os.path.join(directory, entry.name) + ('/' if entry.is_dir() else '') for entry in entries]
+
+    def _cmd_quit(self, args):
+        self.disconnect_ftp()
+        print("👋 Exiting. Goodbye!")
+        return False
+
+    def _cmd_open(self, args):
+        if len(args) < 4:
+            print("Usage: open <host> <port> <username> <password>")
+            return
+        host, port, username, password = args[0], int(args[1]), args[2], args[3]
+        self.connect_ftp(host, username, password, port)
+
+    def _cmd_close(self, args):
+        self.disconnect_ftp()
+
+    def _cmd_ls(self, args):
+        self.list_files()
+
+    def _cmd_cd(self, args):
+        if args:
+            self.change_directory(args[0])
+        else:
+            print("Usage: cd <directory>")
+
+    def _cmd_pwd(self, args):
+        self.print_working_directory()
+
+    def _cmd_lcd(self, args):
+        if args:
+            self.local_change_directory(args[0])
+        else:
+            print("Usage: lcd <directory>")
+            print(f"Current local directory: {os.getcwd()}")
+
+    def _cmd_mkdir(self, args):
+        if args:
+            self.make_directory(args[0])
+        else:
+            print("Usage: mkdir <directory>")
+
+    def _cmd_rmdir(self, args):
+        if args:
+            self.remove_directory(args[0])
+        else:
+            print("Usage: rmdir <directory>")
+
+    def _cmd_delete(self, args):
+        if args:
+            self.delete_file(args[0])
+        else:
+            print("Usage: delete <filename>")
+
+    def _cmd_rename(self, args):
+        if len(args) >= 2:
+            self.rename_item(args[0], args[1])
+        elif len(args) == 1:
+            self.rename_item(args[0])
+        else:
+            print("Usage: rename <old_name> [new_name]")
+
+    def _cmd_get(self, args):
+        if args:
+            local_path = args[1] if len(args) > 1 else None
+            self.download_file(args[0], local_path)
+        else:
+            print("Usage: get <remote_filename> [local_filename]")
+
+    def _cmd_put(self, args):
+        if args:
+            remote_path = args[1] if len(args) > 1 else None
+            self.upload_file(args[0], remote_path)
+        else:
+            print("Usage: put <local_filename> [remote_filename]")
+
+    def _cmd_mget(self, args):
+        if args:
+            self.download_files(args[0])
+        else:
+            print("Usage: mget <remote_directory>")
+
+    def _cmd_mput(self, args):
+        local_dir = args[0] if args else None
+        self.upload_files(local_dir)
+
+    def _cmd_prompt(self, args):
+        self.toggle_prompt()
+
+    def _cmd_ascii(self, args):
+        self.set_transfer_mode('ascii')
+
+    def _cmd_binary(self, args):
+        self.set_transfer_mode('binary')
+
+    def _cmd_passive(self, args):
+        mode = args[0] if args else None
+        self.toggle_passive_mode(mode)
+
+    def _cmd_pipeline(self, args):
+        self.toggle_pipelining(args[0] if args else None)
+
+    def _cmd_progress(self, args):
+        self.toggle_progress(args[0] if args else None)
+
+    def _cmd_parallel(self, args):
+        self.set_parallel_transfers(args[0] if args else None)
+
+    def _cmd_status(self, args):
+        self.show_status()
+
+    def _cmd_set_clamav_agent(self, args):
+        self.set_clamav_agent_config()
+
+    def _cmd_help(self, args):
+        self.show_help()
+
 
 def main():
     """Main program entry point."""
     client = FTPClient()
+    if sys.stdin.isatty():
+        client.enable_completion()
     print("🚀 FTP Client with ClamAV Integration 🚀")
     print("🧠 Type 'help' or '?' for available commands.")
     print("💡 Use 'open <host> <port> <username> <password>' to connect.")
@@ -774,17 +1729,21 @@ def main():
     # Main REPL (Read-Eval-Print Loop).
     while True:
         try:
-            # Create dynamic prompt showing connection status and current working directory (CWD)
-            if client.connected:
+            # Create dynamic prompt showing connection status and current working directory (CWD).
+            # A dropped connection is noticed here without a round-trip, so a dead server
+            # can't hold the prompt up until a timeout.
+            if client.check_connection():
                 try:
-                    current_dir = client.ftp.pwd()
+                    # The directory is tracked through cd, so drawing the prompt
+                    # doesn't cost a PWD round-trip per command.
+                    current_dir = client.ftp.pwd_cached()
                     prompt_str = f"ftp:{current_dir}> "
-                except FTPError:
+                except (FTPError, OSError):
                     prompt_str = "ftp:[disconnected]> "
             else:
                 prompt_str = "ftp> "
                 
-            command = input(prompt_str).strip()
+            command = read_line(prompt_str).strip()
             # If handle_command returns False, it's time to exit.
             if not client.handle_command(command):
                 break
@@ -2,13 +2,30 @@
 # A from-scratch implementation of an FTP client library. It handles the low-level
 # details of the FTP protocol.
 # Now supports:
-# - Both Passive (default) and Active data transfer modes.
+# - Both Passive (default) and Active data transfer modes; Passive uses EPSV where the
+#   server supports it and PASV otherwise.
 # - Progress tracking via callbacks for uploads and downloads.
 # - Custom exceptions for clear error handling.
+# - Byte-range downloads (REST), for fetching one file over several connections.
 
 import socket
+import codecs
+import mmap
 import os
+import posixpath
 import re
+import select
+
+# LIST lines as sent by Unix-like servers ('drwxr-xr-x 2 user group 4096 Jan  1 12:00 name')
+# and by Windows/IIS servers ('01-01-24  12:00PM       <DIR>          name').
+UNIX_LIST_LINE = re.compile(r'^([-dlbcps])\S*\s+.*?\s\w{3}\s+\d{1,2}\s+(?:\d{1,2}:\d{2}|\d{4})\s(.*)$')
+DOS_LIST_LINE = re.compile(r'^\d{2}-\d{2}-\d{2,4}\s+\d{1,2}:\d{2}(?:[AP]M)?\s+(<DIR>|\d+)\s+(.*)$', re.IGNORECASE)
+# The data address in a PASV reply ('227 Entering Passive Mode (h1,h2,h3,h4,p1,p2).'), the
+# data port in an EPSV reply ('229 Entering Extended Passive Mode (|||port|).') and the
+# directory in a PWD reply ('257 "/path" is the current directory.').
+PASV_REPLY = re.compile(r'\((\d+),(\d+),(\d+),(\d+),(\d+),(\d+)\)')
+EPSV_REPLY = re.compile(r'\((.)\1\1(\d+)\1\)')
+PWD_REPLY = re.compile(r'"(.*?)"')
 
 # --- Custom Exceptions for Clearer Error Handling ---
 class FTPError(Exception):
@@ -28,23 +45,61 @@ class FTPTempError(FTPError):
     pass
 
 class FTPClient:
-    def __init__(self, buffer_size=4096, timeout=10):
+    def __init__(self, buffer_size=1 << 16, timeout=10, transfer_buffer_size=1 << 18, rcvbuf=None, sndbuf=None):
         self.control_sock = None
         self.data_sock = None
         self.passive_mode = True # Default to Passive mode.
         self.binary_mode = True
         self.buffer_size = buffer_size
+        # Buffer for binary file transfers, allocated once and reused by every transfer on this
+        # connection. Large blocks keep the syscalls per byte low.
+        self.transfer_view = memoryview(bytearray(transfer_buffer_size))
+        # SO_RCVBUF/SO_SNDBUF for data connections, or None to leave them to the OS. Setting
+        # one turns off the kernel's own buffer autotuning for that direction.
+        self.rcvbuf = rcvbuf
+        self.sndbuf = sndbuf
         self.timeout = timeout
         self.welcome_message = ""
         # Socket for listening in Active Mode.
         self.active_server_sock = None
+        # Control connection data received but not yet returned as a reply, and the buffer
+        # each recv_into() on the control connection reads into first.
+        self.recv_buffer = bytearray()
+        self.control_view = memoryview(bytearray(buffer_size))
+        # Representation type ('I' or 'A') last set on the server, or None if unknown.
+        self.server_type = None
+        # Working directory as last reported by PWD and followed through CWD, or None if unknown.
+        self.current_dir = None
+        # Whether the server accepts EPSV, or None until the first passive transfer finds out.
+        self.epsv_supported = None
+        # Whether the server accepts MLST, or None until is_dir() first finds out.
+        self.mlst_supported = None
+        # Send dependent commands together and read the replies afterwards: a transfer's setup
+        # commands (TYPE, PASV, REST) with the transfer command itself in Passive mode, USER
+        # with PASS, and RNFR with RNTO. Some older servers mishandle this.
+        self.pipelining = False
 
     def connect(self, host, port=21):
         """Open control connection to FTP server."""
         try:
             self.control_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            # Commands are small and each one waits for its reply, so don't let Nagle's
+            # algorithm hold one back. Data connections keep it for bulk transfers.
+            self.control_sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            # The control connection sits idle through long transfers and between commands;
+            # keepalives stop NAT devices and firewalls from dropping it in the meantime.
+            self.control_sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            if hasattr(socket, 'TCP_KEEPIDLE'):
+                self.control_sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 60)
+                self.control_sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 15)
+                self.control_sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 4)
             self.control_sock.settimeout(self.timeout)
             self.control_sock.connect((host, port))
+            self.recv_buffer = bytearray()
+            self.server_type = None
+            self.current_dir = None
+            self.epsv_supported = None
+            self.mlst_supported = None
             # The first message is the welcome message
             self.welcome_message = self._get_response()
         except socket.gaierror:
@@ -66,20 +121,18 @@ class FTPClient:
         self.control_sock.sendall(data.encode('utf-8'))
 
     def _get_response(self):
-        """Read response lines until a complete reply code."""
-        reply = ""
+        """Read one complete reply from the control connection."""
         while True:
+            reply = self._take_reply()
+            if reply is not None:
+                break
             try:
-                chunk = self.control_sock.recv(self.buffer_size).decode('utf-8')
-                if not chunk:
-                    raise FTPConnectError("Control connection closed unexpectedly.")
-                reply += chunk
-                # Check if last line is final of a multi-line response
-                # A complete FTP response ends with 'DDD ' where D is a digit.
-                if len(reply) >= 4 and reply[-1] == '\n' and re.search(r'^\d{3} ', reply.splitlines()[-1]):
-                    break
+                count = self.control_sock.recv_into(self.control_view)
             except socket.timeout:
                 raise FTPConnectError("Timeout waiting for server response.")
+            if not count:
+                raise FTPConnectError("Control connection closed unexpectedly.")
+            self.recv_buffer += self.control_view[:count]
         status_code = int(reply[:3])
         if status_code >= 500:
             raise FTPPermError(reply.strip())
@@ -87,49 +140,138 @@ class FTPClient:
             raise FTPTempError(reply.strip())  
         return reply.strip()
 
+    def _take_reply(self):
+        """
+        Remove the first complete reply from the receive buffer and return it,
+        or None if it hasn't fully arrived yet. A single recv() can hold more
+        than one reply (e.g. '150' and '226' for a short transfer), so anything
+        after the first reply stays buffered for the next call.
+        """
+        buf = self.recv_buffer
+        end = buf.find(b'\n')
+        if end < 0:
+            return None
+        if buf[3:4] == b'-':
+            # A multi-line reply ends with a line starting with the same code and a space.
+            last_line = buf.find(b'\n' + buf[:3] + b' ', end)
+            if last_line < 0:
+                return None
+            end = buf.find(b'\n', last_line + 1)
+            if end < 0:
+                return None
+        reply = bytes(buf[:end + 1])
+        del buf[:end + 1]
+        return reply.decode('utf-8', errors='replace')
+
     def login(self, user, password):
-        """Send USER and PASS commands."""
+        """Send USER and PASS commands (in one go when pipelining)."""
+        if self.pipelining:
+            user_resp, pass_resp = self._pipeline([f"USER {user}", f"PASS {password}"])
+            if isinstance(user_resp, str) and user_resp.startswith('230'):
+                # Logged in without a password; the PASS reply is an error that doesn't matter.
+                return user_resp
+            for resp in (user_resp, pass_resp):
+                if isinstance(resp, FTPError):
+                    raise resp
+            return pass_resp
         self._send_command(f"USER {user}")
         self._get_response() # Server asks for password
         self._send_command(f"PASS {password}")
         resp = self._get_response() # Final login response
         return resp
 
+    def _pipeline(self, commands):
+        """
+        Send commands in one go and then read their replies, so the sequence costs one
+        round-trip instead of one per command. Returns a list with each command's reply,
+        or the FTPPermError/FTPTempError it got, so the caller can tell which one failed.
+        """
+        self.control_sock.sendall(''.join(c + '\r\n' for c in commands).encode('utf-8'))
+        # Read every reply, even after a failure, so none is left for the next command.
+        replies = []
+        for _ in commands:
+            try:
+                replies.append(self._get_response())
+            except (FTPPermError, FTPTempError) as e:
+                replies.append(e)
+        return replies
+
     def enter_active_mode(self):
         """
         Initializes a listening socket on the client side for Active Mode
         and sends the PORT command to the server.
         """
         self.active_server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # Accepted data connections inherit the buffer sizes from the listening socket.
+        self._set_socket_buffers(self.active_server_sock)
         # Bind to the same IP as the control connection, on a random free port (port 0).
         self.active_server_sock.bind((self.control_sock.getsockname()[0], 0))
         self.active_server_sock.listen(1)
+        # Don't wait forever for a server that never connects back.
+        self.active_server_sock.settimeout(self.timeout)
 
         host, port = self.active_server_sock.getsockname()
 
-        host_parts = host.split('.')
-        # Divide the port into high and low bytes for the PORT command.
-        port_high, port_low = divmod(port, 256)
-
-        port_cmd = f"PORT {','.join(host_parts)},{port_high},{port_low}"
+        # PORT takes the address's four numbers and the port's high and low bytes, comma-separated.
+        port_cmd = f"PORT {host.replace('.', ',')},{port >> 8},{port & 0xff}"
         self._send_command(port_cmd)
         self._get_response()
 
     def enter_passive_mode(self):
         """Switch to passive mode and open data socket."""
+        # EPSV is tried first, as it connects to the control connection's own address and so
+        # isn't thrown off by a server behind NAT reporting its private one. A server that
+        # refuses it is only asked once per connection.
+        if self.epsv_supported is not False:
+            self._send_command('EPSV')
+            try:
+                resp = self._get_response()
+            except FTPPermError:
+                self.epsv_supported = False
+            else:
+                self.epsv_supported = True
+                self._connect_extended_passive(resp)
+                return
         self._send_command('PASV')
-        resp = self._get_response()
+        self._connect_passive(self._get_response())
+
+    def _connect_passive(self, resp):
+        """Open the data socket to the address in a PASV reply."""
         # Parse the host and port from the server's PASV response.
-        match = re.search(r'\((\d+,\d+,\d+,\d+),(\d+),(\d+)\)', resp)
+        match = PASV_REPLY.search(resp)
         if not match:
             raise FTPError(f"Failed to parse PASV response: {resp}")
-        
-        host_parts = match.group(1).split(',')
-        p1, p2 = int(match.group(2)), int(match.group(3))
 
-        data_host = '.'.join(host_parts)
-        data_port = (p1 * 256) + p2
-        self.data_sock = socket.create_connection((data_host, data_port), timeout=self.timeout)
+        h1, h2, h3, h4, p1, p2 = match.groups()
+        self._open_data_socket(f'{h1}.{h2}.{h3}.{h4}', (int(p1) << 8) | int(p2))
+
+    def _connect_extended_passive(self, resp):
+        """Open the data socket to the port in an EPSV reply, on the control connection's host."""
+        match = EPSV_REPLY.search(resp)
+        if not match:
+            raise FTPError(f"Failed to parse EPSV response: {resp}")
+        self._open_data_socket(self.control_sock.getpeername()[0], int(match.group(2)))
+
+    def _open_data_socket(self, data_host, data_port):
+        """Connect the data socket to data_host:data_port."""
+        # The buffer sizes are set before connecting, so the TCP window scale negotiated
+        # in the handshake can make use of them.
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            self._set_socket_buffers(sock)
+            sock.settimeout(self.timeout)
+            sock.connect((data_host, data_port))
+        except OSError:
+            sock.close()
+            raise
+        self.data_sock = sock
+
+    def _set_socket_buffers(self, sock):
+        """Apply the configured SO_RCVBUF/SO_SNDBUF sizes, if any, to sock."""
+        if self.rcvbuf:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
+        if self.sndbuf:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.sndbuf)
 
     def set_pasv(self, value):
         """Enable or disable passive mode."""
@@ -145,121 +287,421 @@ class FTPClient:
         # It's good practice to immediately tell the server the type
         self._send_command(f"TYPE {'I' if self.binary_mode else 'A'}")
         self._get_response()
+        self.server_type = 'I' if self.binary_mode else 'A'
         print(f"Transfer mode set to: {'BINARY' if self.binary_mode else 'ASCII'} on server.")
    
-    def nlst(self, path=''):
-        """List names using NLST, supporting both Active and Passive modes."""
-        # Step 1: Establish the data connection based on the current mode.
-        if self.passive_mode:
-            self.enter_passive_mode()
+    def _start_transfer(self, cmd, binary=None, rest=None):
+        """
+        Set up a data connection and send cmd (RETR, STOR, NLST...) to start a transfer over
+        it, preceded by TYPE (unless binary is None or the server is already in that mode)
+        and by REST if rest is given. Returns with self.data_sock connected.
+        """
+        # The first passive transfer is set up step by step, to find out whether EPSV works.
+        if self.pipelining and self.passive_mode and self.epsv_supported is not None:
+            self._start_transfer_pipelined(cmd, binary, rest)
         else:
-            self.enter_active_mode()
-
-        # Step 2: Send the NLST command.
-        self._send_command(f'NLST {path}')
-        resp = self._get_response() # Initial response (e.g., "150 Here comes the directory listing.")
-
-        # Step 3: In Active mode, accept the incoming connection from the server.
+            if self.passive_mode:
+                self.enter_passive_mode()
+            else:
+                self.enter_active_mode()
+            try:
+                if binary is not None:
+                    self._set_type(binary)
+                if rest is not None:
+                    self._send_command(f'REST {rest}')
+                    self._get_response()
+                self._send_command(cmd)
+                self._get_response() # Initial response (e.g., "150 Opening data connection.")
+            except FTPError:
+                # The server refused the command; drop the unused data connection.
+                self._close_data_connection()
+                raise
+
+        # In Active mode, accept the incoming connection from the server.
         if not self.passive_mode:
-            self.data_sock, _ = self.active_server_sock.accept()
+            try:
+                self.data_sock, _ = self.active_server_sock.accept()
+            except socket.timeout:
+                # The server took the command but never connected. Its reply saying so could
+                # arrive at any time and be taken for the next command's, so the control
+                # connection can't be relied on any more either.
+                self.close()
+                raise FTPConnectError("Timeout waiting for the server to open the data connection (try passive mode).")
+            # Accepted sockets don't inherit the timeout; match the Passive mode data socket.
+            self.data_sock.settimeout(self.timeout)
             self.active_server_sock.close()
             self.active_server_sock = None
 
-        # Step 4: Receive all data from the data socket.
-        data = b''
+    def _start_transfer_pipelined(self, cmd, binary, rest):
+        """
+        _start_transfer() with every command sent in one go and the replies read afterwards,
+        so setting up a transfer costs one round-trip instead of one per command. Passive
+        mode only: some servers answer PORT only once they have connected back, which
+        puts its reply after the transfer command's.
+        """
+        type_code = None
+        commands = []
+        if binary is not None:
+            type_code = 'I' if binary else 'A'
+            if self.server_type != type_code:
+                commands.append(f'TYPE {type_code}')
+        pasv_cmd = 'EPSV' if self.epsv_supported else 'PASV'
+        commands.append(pasv_cmd)
+        if rest is not None:
+            commands.append(f'REST {rest}')
+        commands.append(cmd)
+        self.control_sock.sendall(''.join(c + '\r\n' for c in commands).encode('utf-8'))
+
+        # Read every reply, even after a failure, so none is left for the next command.
+        error = None
+        try:
+            for command in commands:
+                try:
+                    resp = self._get_response()
+                except (FTPPermError, FTPTempError) as e:
+                    error = error or e
+                    continue
+                if command is pasv_cmd:
+                    # Connect even if something failed before: the server may hold back
+                    # the transfer command's reply until the data connection is up.
+                    try:
+                        if pasv_cmd == 'EPSV':
+                            self._connect_extended_passive(resp)
+                        else:
+                            self._connect_passive(resp)
+                    except (FTPError, OSError) as e:
+                        # The transfer command will fail without it; read its reply first.
+                        error = error or e
+                elif command.startswith('TYPE'):
+                    self.server_type = type_code
+                elif command is cmd and error is not None:
+                    # The transfer started although its setup failed; abort it.
+                    self._close_data_connection()
+                    try:
+                        self._get_response()
+                    except FTPError:
+                        pass
+        except (FTPConnectError, OSError):
+            # A reply never came (e.g. the server is still waiting for a data connection
+            # that failed), so the replies no longer line up with the commands.
+            self.close()
+            raise
+        if error is not None:
+            self._close_data_connection()
+            raise error
+
+    def _read_listing(self, cmd):
+        """Run a listing command (NLST, MLSD), supporting both Active and Passive modes, and return its lines."""
+        # Step 1: Establish the data connection and send the listing command.
+        self._start_transfer(cmd)
+
+        # Step 2: Receive all data from the data socket, into the transfer buffer. A bytearray
+        # grows in place, where concatenating bytes would copy everything received so far
+        # on every chunk.
+        data = bytearray()
+        view = self.transfer_view
         while True:
-            chunk = self.data_sock.recv(self.buffer_size)
-            if not chunk:
+            count = self.data_sock.recv_into(view)
+            if not count:
                 break
-            data += chunk
+            data += view[:count]
         self.data_sock.close()
 
-        # Step 5: Get the final confirmation from the server.
+        # Step 3: Get the final confirmation from the server.
         self._get_response() # Final response (e.g., "226 Directory send OK.")
         
         # Decode and split into a list, filtering out empty lines
         return [line for line in data.decode('utf-8').splitlines() if line.strip()]
 
+    def _close_data_connection(self):
+        """Close a data connection that was set up but won't be used."""
+        for sock in (self.data_sock, self.active_server_sock):
+            if sock:
+                sock.close()
+        self.data_sock = None
+        self.active_server_sock = None
+
+    def _set_type(self, binary):
+        """Send TYPE for a transfer, unless the server is already in that mode."""
+        type_code = 'I' if binary else 'A'
+        if self.server_type != type_code:
+            self._send_command(f"TYPE {type_code}")
+            self._get_response()
+            self.server_type = type_code
+
+    def nlst(self, path=''):
+        """List names using NLST."""
+        return self._read_listing(f'NLST {path}')
+
+    def mlsd(self, path=''):
+        """
+        List a directory using MLSD, which gives the type of every entry in one reply.
+        Returns a list of (name, facts) tuples, where facts is a dict such as
+        {'type': 'file', 'size': '123'} with lower-case keys.
+        """
+        entries = []
+        for line in self._read_listing(f'MLSD {path}'):
+            # Each line is 'fact1=value1;fact2=value2; name'.
+            facts_part, _, name = line.partition(' ')
+            entries.append((name, self._parse_facts(facts_part)))
+        return entries
+
+    def mlst(self, path):
+        """
+        Get the facts about a single path using MLST, which answers on the control
+        connection with no data connection. Returns a dict like mlsd()'s.
+        """
+        self._send_command(f'MLST {path}')
+        resp = self._get_response()
+        # The facts are on the reply's middle line: ' fact1=value1;fact2=value2; name'.
+        for line in resp.splitlines()[1:]:
+            if line.startswith(' '):
+                return self._parse_facts(line[1:].partition(' ')[0])
+        raise FTPError(f"Failed to parse MLST response: {resp}")
+
+    @staticmethod
+    def _parse_facts(facts_part):
+        """Turn 'fact1=value1;fact2=value2;' into a dict with lower-case keys."""
+        facts = {}
+        for fact in facts_part.split(';'):
+            key, sep, value = fact.partition('=')
+            if sep:
+                facts[key.lower()] = value
+        return facts
+
+    def is_dir(self, path):
+        """
+        Tell whether path is a directory on the server. Takes one MLST round-trip where
+        the server supports it; otherwise changes into path and back.
+        """
+        if self.mlst_supported is not False:
+            try:
+                facts = self.mlst(path)
+            except FTPPermError as e:
+                # 500/502: MLST itself isn't supported. Anything else (550) is about path.
+                if not str(e).startswith(('500', '502')):
+                    return False
+                self.mlst_supported = False
+            else:
+                self.mlst_supported = True
+                return facts.get('type', '').lower() in ('dir', 'cdir', 'pdir')
+        previous_dir = self.pwd_cached()
+        try:
+            self.cwd(path)
+        except FTPPermError:
+            return False
+        self.cwd(previous_dir)
+        return True
+
+    def mkdirs(self, path):
+        """
+        Create directory path along with any missing parents; an existing directory is not
+        an error. Checks from the deepest directory up, so a path that exists already costs
+        one check, and only the missing part of a partly existing one is created.
+        """
+        prefix = '/' if path.startswith('/') else ''
+        parts = [part for part in path.split('/') if part]
+        depth = len(parts)
+        while depth > 0 and not self.is_dir(prefix + '/'.join(parts[:depth])):
+            depth -= 1
+        for end in range(depth + 1, len(parts) + 1):
+            self.mkd(prefix + '/'.join(parts[:end]))
+
+    def list_dir(self, path=''):
+        """
+        List a directory using LIST and tell directories from files by the listing format.
+        Returns a list of (name, is_dir) tuples, where is_dir is None for symbolic links,
+        whose target type the listing doesn't show. Special files are left out. Returns
+        None if a line is in a format this doesn't recognise.
+        """
+        entries = []
+        for line in self._read_listing(f'LIST {path}'.rstrip()):
+            match = UNIX_LIST_LINE.match(line)
+            if match:
+                kind, name = match.groups()
+                if kind == 'l':
+                    # 'name -> target'
+                    entries.append((name.split(' -> ', 1)[0], None))
+                elif kind in '-d':
+                    entries.append((name, kind == 'd'))
+                continue
+            match = DOS_LIST_LINE.match(line)
+            if match:
+                size_or_dir, name = match.groups()
+                entries.append((name, size_or_dir.upper() == '<DIR>'))
+                continue
+            if line.startswith('total '):
+                continue  # Unix 'ls -l' block count.
+            return None
+        return [(name, is_dir) for name, is_dir in entries if name not in ('.', '..')]
+
     def cwd(self, dirpath):
         """Change working directory."""
         self._send_command(f'CWD {dirpath}')
-        return self._get_response()
+        resp = self._get_response()
+        # Follow the change locally so pwd_cached() doesn't need a PWD round-trip.
+        # '~' paths are expanded by the server, and '..' after a symlink leads to the
+        # link target's parent rather than the one normpath() gives, so those need a real PWD.
+        if (self.current_dir is not None and not dirpath.startswith('~')
+                and '..' not in dirpath.split('/')):
+            self.current_dir = posixpath.normpath(posixpath.join(self.current_dir, dirpath))
+        else:
+            self.current_dir = None
+        return resp
 
     def pwd(self):
         """Get current working directory, parsing the response."""
         self._send_command('PWD')
         resp = self._get_response()
         # Typical response: 257 "/path/to/dir" is the current directory.
-        match = re.search(r'"(.*?)"', resp)
-        if match:
-            return match.group(1)
-        return "Unknown" # Fallback
+        match = PWD_REPLY.search(resp)
+        if not match:
+            self.current_dir = None
+            raise FTPError(f"Failed to parse PWD response: {resp}")
+        self.current_dir = match.group(1)
+        return self.current_dir
+
+    def pwd_cached(self):
+        """Get current working directory, without asking the server if it is already known."""
+        if self.current_dir is None:
+            return self.pwd()
+        return self.current_dir
 
     def retr(self, remote_file, local_path, binary=True, callback = None):
         """Download remote_file to local_path (RETR command)."""
-        if self.passive_mode:
-            self.enter_passive_mode()
-        else:
-            self.enter_active_mode()
-        
-        self._send_command(f"TYPE {'I' if binary else 'A'}")
-        self._get_response()
-
-        self._send_command(f'RETR {remote_file}')
-        self._get_response()
-
-        # Accept connection if in active mode
-        if not self.passive_mode:
-            self.data_sock, _ = self.active_server_sock.accept()
-            self.active_server_sock.close()
-            self.active_server_sock = None
+        self._start_transfer(f'RETR {remote_file}', binary)
 
         # Read from the data socket and write to the local file.
-        with open(local_path, 'wb' if binary else 'w', encoding=None if binary else 'utf-8') as f:
-            while True:
-                chunk = self.data_sock.recv(self.buffer_size)
-                if not chunk:
-                    break
-                f.write(chunk)
-                # If a callback is provided, call it with the chunk of data.
-                if callback: callback(chunk) # update progress bar
+        if binary:
+            # Receive into the reusable transfer buffer and write it out directly, with no
+            # per-chunk allocations. The callback gets a view of that buffer.
+            view = self.transfer_view
+            with open(local_path, 'wb') as f:
+                while True:
+                    count = self.data_sock.recv_into(view)
+                    if not count:
+                        break
+                    f.write(view[:count])
+                    if callback: callback(view[:count]) # update progress bar
+        else:
+            # Also received into the transfer buffer. The incremental decoder keeps a
+            # character split between two chunks until the rest of it arrives.
+            view = self.transfer_view
+            decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+            with open(local_path, 'w', encoding='utf-8') as f:
+                while True:
+                    count = self.data_sock.recv_into(view)
+                    if not count:
+                        break
+                    f.write(decoder.decode(view[:count]))
+                    # If a callback is provided, call it with the chunk of data.
+                    if callback: callback(view[:count]) # update progress bar
+                f.write(decoder.decode(b'', final=True))
         self.data_sock.close()
         return self._get_response()
 
+    def retr_range(self, remote_file, local_path, offset, length, callback = None):
+        """
+        Download length bytes of remote_file starting at offset (REST + RETR) into the same
+        place in local_path, which must already exist. Always binary.
+        """
+        self._start_transfer(f'RETR {remote_file}', True, rest=offset)
+
+        # The server sends everything from offset to the end of the file; stop after length bytes.
+        remaining = length
+        view = self.transfer_view
+        with open(local_path, 'r+b') as f:
+            f.seek(offset)
+            while remaining > 0:
+                count = self.data_sock.recv_into(view[:remaining])
+                if not count:
+                    break
+                f.write(view[:count])
+                remaining -= count
+                if callback: callback(view[:count]) # update progress bar
+        self.data_sock.close()
+        self.data_sock = None
+
+        try:
+            resp = self._get_response()
+        except FTPTempError:
+            # Closing the data connection early aborts the transfer (426), which is expected.
+            resp = None
+        if remaining > 0:
+            raise FTPError(f"Transfer of {remote_file} ended {remaining} bytes short of the requested range")
+        return resp
+
     def stor(self, local_path, remote_path=None, binary=True, callback = None):
         """Upload local_file to server as remote_path (or basename if not specified) (STOR command)."""
         filename = os.path.basename(local_path) if remote_path is None else remote_path
-        if self.passive_mode:
-            self.enter_passive_mode()
-        else:
-            self.enter_active_mode()
-
-        self._send_command(f"TYPE {'I' if binary else 'A'}")
-        self._get_response()
-
-        self._send_command(f'STOR {filename}')
-        self._get_response()
+        self._start_transfer(f'STOR {filename}', binary)
 
-        # Accept connection if in active mode
-        if not self.passive_mode:
-            self.data_sock, _ = self.active_server_sock.accept()
-            self.active_server_sock.close()
-            self.active_server_sock = None
-        
         # Read the local file in chunks and send them over the data socket.
-        with open(local_path, 'rb' if binary else 'r', encoding=None if binary else 'utf-8') as f:
-            while True:
-                chunk = f.read(self.buffer_size)
-                if not chunk:
-                    break
-                # Ensure data is bytes before sending (for text mode).
-                data_to_send = chunk if binary else chunk.encode('utf-8')
-                self.data_sock.sendall(data_to_send)
-                # If a callback is provided, call it to update progress.
-                if callback: callback(data_to_send) # update progress bar
+        try:
+            if binary:
+                with open(local_path, 'rb') as f:
+                    if hasattr(os, 'sendfile'):
+                        self._sendfile(f, callback)
+                    else:
+                        # Read into the reusable transfer buffer, as in retr().
+                        view = self.transfer_view
+                        while True:
+                            count = f.readinto(view)
+                            if not count:
+                                break
+                            self.data_sock.sendall(view[:count])
+                            if callback: callback(view[:count]) # update progress bar
+            else:
+                with open(local_path, 'r', encoding='utf-8') as f:
+                    while True:
+                        chunk = f.read(self.buffer_size)
+                        if not chunk:
+                            break
+                        # Ensure data is bytes before sending (for text mode).
+                        data_to_send = chunk.encode('utf-8')
+                        self.data_sock.sendall(data_to_send)
+                        # If a callback is provided, call it to update progress.
+                        if callback: callback(data_to_send) # update progress bar
+        except Exception:
+            # Abort the transfer, taking the server's replies to it so the next command
+            # doesn't get them, and then report the failure.
+            try:
+                self.abort()
+            except (FTPError, OSError):
+                pass
+            raise
         self.data_sock.close()
         return self._get_response()
     
+    def _sendfile(self, f, callback=None):
+        """
+        Send binary file f over the data socket with sendfile(), so the kernel copies it
+        straight from the page cache without it passing through Python. For the callback,
+        the file is memory-mapped and each step's bytes are passed as a view of the mapping,
+        which costs nothing unless the callback reads them.
+        """
+        if callback is None:
+            self.data_sock.sendfile(f)
+            return
+        file_size = os.fstat(f.fileno()).st_size
+        if file_size == 0:
+            return
+        step = len(self.transfer_view)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+            offset = 0
+            while offset < file_size:
+                sent = self.data_sock.sendfile(f, offset, min(step, file_size - offset))
+                if not sent:
+                    break
+                # Released on the way out, even if the callback raises: the mapping can't be
+                # closed while a view of it is still held (e.g. by a traceback).
+                with view[offset:offset + sent] as chunk:
+                    callback(chunk) # update progress bar
+                offset += sent
+        if offset < file_size:
+            # sendfile() sends nothing past the end of the file, so it got shorter meanwhile.
+            raise OSError(f"File shrank while being uploaded: sent {offset} of {file_size} bytes")
+
     def mkd(self, dirname):
         """Creates a directory."""
         self._send_command(f'MKD {dirname}')
@@ -277,6 +719,12 @@ class FTPClient:
 
     def rename(self, old_name, new_name):
         """Renames a file."""
+        if self.pipelining:
+            # If RNFR fails, the server refuses the RNTO too; the RNFR error is the one to report.
+            for resp in self._pipeline([f'RNFR {old_name}', f'RNTO {new_name}']):
+                if isinstance(resp, FTPError):
+                    raise resp
+            return resp
         self._send_command(f'RNFR {old_name}')
         self._get_response()
         self._send_command(f'RNTO {new_name}')
@@ -291,15 +739,53 @@ class FTPClient:
         self._send_command('NOOP')
         return self._get_response()
 
+    def abort(self):
+        """
+        Abort the transfer in progress (ABOR) and close its data connection. The server
+        answers with one or two replies depending on how far the transfer got, so a NOOP
+        goes right behind the ABOR and replies are read up to the NOOP's, leaving none behind.
+        """
+        self.control_sock.sendall(b'ABOR\r\nNOOP\r\n')
+        self._close_data_connection()
+        while True:
+            try:
+                resp = self._get_response()
+            except (FTPPermError, FTPTempError):
+                continue
+            if resp.startswith('200'):
+                return resp
+
     def quit(self):
         """Send QUIT command and close connection."""
         try:
             self._send_command('QUIT')
             self._get_response()
         finally:
+            self._close_data_connection()
             if self.control_sock:
                 self.control_sock.close()
                 self.control_sock = None
+
+    def connection_lost(self):
+        """
+        Whether the server has closed the control connection, e.g. on its idle timeout.
+        Between commands the server has nothing to say, so the connection only becomes
+        readable (EOF, or a 421 sent before closing) once it is gone. No round-trip.
+        """
+        if not self.control_sock:
+            return True
+        try:
+            return bool(select.select([self.control_sock], [], [], 0)[0])
+        except (OSError, ValueError):
+            return True
+
+    def close(self):
+        """Close the control connection without sending QUIT, e.g. once the server has dropped it."""
+        self._close_data_connection()
+        if self.control_sock:
+            self.control_sock.close()
+            self.control_sock = None
+
     def size(self, filename):
         """Get the size of a file on the server using the SIZE command."""
         self._send_command(f'SIZE {filename}')